@@ -15,16 +15,20 @@ Genes with variable sections can be aligned to save library space (avoid synthes
 Use align_genevariation()
 """
 
+import contextlib
+import hashlib
 import itertools
 import os
-import re
 import warnings
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from difflib import SequenceMatcher
-from math import ceil
-from DIMPLE.utilities import findORF
+from DIMPLE.utilities import batch_Tm_NN, CodonModel, EditHash, findORF, Tm_NN, WindowTm
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from Bio import SeqIO, Align
+from Bio.SeqIO.FastaIO import FastaWriter
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 from Bio.SeqUtils import MeltingTemp as mt
@@ -37,6 +41,9 @@ def addgene(genefile, start=None, end=None):
         start = []
     if end is None:
         end = []
+    # a new set of genes starts a new run, drop the indexes and models of earlier runs
+    DIMPLE.seqIndexes.clear()
+    DIMPLE.codonModels.clear()
     tmpgene = list(SeqIO.parse(genefile.replace("\\", ""), "fasta"))
     tmpgene[0].seq = tmpgene[0].seq.upper()
     tmpOLS = []
@@ -72,6 +79,17 @@ class DIMPLE:
     allhangR = []
     primerTm = (56.5, 60)  # Melting temperature limits for primers
     gene_primerTm = (58, 62)  # Help gene primer amplification
+    qc_seed = 3  # k-mer length seeding post_qc. Up to 3 finds every site, 0 scans every offset
+    anchor_seed = 8  # length of the 3' terminal k-mer check_nonspecific looks up (see seq_index)
+    seqIndexes = {}  # SeedIndex of every record sequence by hash, shared by genes of the same record
+    plan_fragments = False  # choose all breaksites at once with plan_breaksites
+    unique_overhangs = False  # every overhang of a gene must be unique, not only within a fragment
+    stream_oligos = False  # write oligos to their files as they are made instead of keeping them
+    codonModels = {}  # CodonModel of every usage table and set of synonymous codons
+    double_count = 0  # double mutants picked per fragment with make_double, 0 makes every pair
+    double_window = 0  # only pair substitutions within this many codons, 0 for any distance
+    redundant_table = False  # report redundant variants in <gene>_Redundant.tsv instead of a fasta
+    redundant_sequences = False  # with redundant_table, also write <gene>_Redundant.fasta
 
     # Load Barcodes
     dataDirectory = os.path.abspath(os.path.dirname(__file__))
@@ -119,6 +137,7 @@ class DIMPLE:
         self.doublefrag = 0
         self.filename = gene.filename
         self.redundantSeq = []
+        self.redundantTable = []  # (variant id, id of the variant it copies, reason)
         # Set up variables. Could have this as user input in the class
         self.SynonymousCodons = {
             "Cys": ["TGT", "TGC"],
@@ -221,6 +240,11 @@ class DIMPLE:
             [x, x + fragsize[idx]] for idx, x in enumerate(breaksites[:-1])
         ]  # insertion site to insertion site
         self.problemsites = set()
+        self.seqIndex = None  # built on first use by seq_index
+        self.primerCache = {}  # find_gene_primer results, see gene_primer
+        self.primerTables = {}  # PrimerTable for each pair of overlaps, see primer_table
+        self.overlaps = ()  # overlaps of the current run, used by plan_breaksites
+        self.constraints = None  # ConstraintTracker, see constraint_tracker
         self.unique_Frag = [True] * len(fragsize)
         self.fragsize = fragsize
         self.__breaksites = breaksites
@@ -229,6 +253,86 @@ class DIMPLE:
         else:
             self.phase = [0]
 
+    def seq_index(self):
+        """Return the IndexWindow of seq used by check_nonspecific.
+
+        The index covers the whole record sequence (fullGene), extended by
+        primerBuffer on each side with the other end of the plasmid, and seq is
+        a window into it. Indexes are kept in DIMPLE.seqIndexes, so genes of the
+        same record (or of records with the same sequence) share one index.
+        """
+        if self.seqIndex is None:
+            record = self.fullGene
+            padded = record[-self.primerBuffer:] + record + record[: self.primerBuffer]
+            key = (sequence_hash(record), self.primerBuffer)
+            if key not in DIMPLE.seqIndexes:
+                DIMPLE.seqIndexes[key] = SeedIndex([padded], DIMPLE.anchor_seed)
+            index = DIMPLE.seqIndexes[key]
+            start = self.start + 3  # seq starts primerBuffer before the ORF
+            if padded[start: start + len(self.seq)] != self.seq:
+                # seq is not a window of the record, index it on its own
+                index, start = SeedIndex([self.seq], DIMPLE.anchor_seed), 0
+            self.seqIndex = IndexWindow(index, start, len(self.seq))
+        return self.seqIndex
+
+    def codon_model(self, cutoff=0.1):
+        """Return the CodonModel of usage and SynonymousCodons with this usage cutoff.
+
+        Models are kept in DIMPLE.codonModels, so each is only built once per run.
+        """
+        key = (
+            tuple(sorted(self.usage.items())),
+            tuple((name, tuple(codons)) for name, codons in self.SynonymousCodons.items()),
+            cutoff,
+        )
+        if key not in DIMPLE.codonModels:
+            DIMPLE.codonModels[key] = CodonModel(self.usage, self.SynonymousCodons, cutoff)
+        return DIMPLE.codonModels[key]
+
+    def add_redundant(self, variant, original=None):
+        """Keep a variant left out of the library for the redundant reports.
+
+        The variant is a copy of original, or has a premature stop when original
+        is None. Sequences are only kept when Redundant.fasta will be written.
+        """
+        if DIMPLE.redundant_table:
+            if original is None:
+                self.redundantTable.append((variant.id, "", "STOP"))
+            else:
+                self.redundantTable.append((variant.id, original.id, "duplicate"))
+        if DIMPLE.redundant_sequences or not DIMPLE.redundant_table:
+            self.redundantSeq.append(variant)
+
+    def gene_primer(self, direction, breaksite, overlap):
+        """Return the find_gene_primer result for a breaksite, searching it once.
+
+        Results are kept in primerCache by (breaksite, overlap, direction). The
+        primer only depends on these, so after fragments are moved and checked
+        again only the moved breaksites are searched.
+        """
+        key = (breaksite, overlap, direction)
+        if key not in self.primerCache:
+            self.primerCache[key] = find_gene_primer(self, direction, breaksite, overlap)
+        return self.primerCache[key]
+
+    def primer_table(self, overlapL, overlapR):
+        """Return the PrimerTable of the gene primers for these overlaps."""
+        if (overlapL, overlapR) not in self.primerTables:
+            self.primerTables[(overlapL, overlapR)] = PrimerTable(self, overlapL, overlapR)
+        return self.primerTables[(overlapL, overlapR)]
+
+    def constraint_tracker(self, overlapL, overlapR, OLS=()):
+        """Return the ConstraintTracker of the fragments for these overlaps.
+
+        Linked genes are taken from OLS and checked together with this gene.
+        """
+        if self.constraints is None or (
+            self.constraints.overlapL, self.constraints.overlapR
+        ) != (overlapL, overlapR):
+            linked = [OLS[idx] for idx in sorted(self.linked) if OLS[idx] is not self]
+            self.constraints = ConstraintTracker(self, overlapL, overlapR, linked)
+        return self.constraints
+
     def ochre(self):
         if len(self.SynonymousCodons["STOP"]) < 2:
             raise Exception("You have removed all stop codons")
@@ -436,7 +540,7 @@ def align_genevariation(OLS):
         )
 
 
-def find_geneprimer(genefrag, start, end):
+def find_geneprimer(genefrag, start, end, verbose=True):
     # 3' end of primer is variable to adjust melting temperature
     # 5' end of primer is fixed, with restriction site added
     primer = (
@@ -448,8 +552,12 @@ def find_geneprimer(genefrag, start, end):
     while primer.complement()[end - start + comp] == genefrag[end + comp]:
         comp += 1
     # comp += 1 # This is important for single basepair overhang
-    tm2 = mt.Tm_NN(primer[0: end - start + comp], nn_table=mt.DNA_NN2)
-    tm4 = mt.Tm_NN(primer[0: end - start + comp], nn_table=mt.DNA_NN4)
+    # primer[0: end - start + comp] is always template[start: end + comp]
+    template = genefrag.complement()
+    templateNN2 = WindowTm(template, mt.DNA_NN2)
+    templateNN4 = WindowTm(template, mt.DNA_NN4)
+    tm2 = templateNN2.tm(start, end + comp)
+    tm4 = templateNN4.tm(start, end + comp)
     count = 0
     while (
         tm2 < DIMPLE.gene_primerTm[0]
@@ -462,8 +570,8 @@ def find_geneprimer(genefrag, start, end):
             primer = (
                 genefrag[start:end].complement() + DIMPLE.cutsite[::-1] + "ATA"
             )  # cut site addition
-            tm2 = mt.Tm_NN(primer[0: end - start + comp], nn_table=mt.DNA_NN2)
-            tm4 = mt.Tm_NN(primer[0: end - start + comp], nn_table=mt.DNA_NN4)
+            tm2 = templateNN2.tm(start, end + comp)
+            tm4 = templateNN4.tm(start, end + comp)
         if (
             count > 12 or start == 0
         ):  # stop if caught in inf loop or if linker is at max (31 + 7 = 38 bases)
@@ -472,8 +580,8 @@ def find_geneprimer(genefrag, start, end):
             start += 1
             primer = genefrag[start:end].complement() + DIMPLE.cutsite[::-1] + "ATA"
             # tm = mt.Tm_NN(primer[0:e-s+comp],c_seq=genefrag[s:e+comp],nn_table=mt.DNA_NN2)
-            tm2 = mt.Tm_NN(primer[0: end - start + comp], nn_table=mt.DNA_NN2)
-            tm4 = mt.Tm_NN(primer[0: end - start + comp], nn_table=mt.DNA_NN4)
+            tm2 = templateNN2.tm(start, end + comp)
+            tm4 = templateNN4.tm(start, end + comp)
         count += 1
     # optional - force first nucleotide to a C or G
     # while primer[0]=="T" or primer[0]=="A" or primer[0]=="t" or primer[0]=="a":
@@ -481,12 +589,13 @@ def find_geneprimer(genefrag, start, end):
     #     primer = genefrag[s:e].complement()+"CTCTGCA"
     #     tm = mt.Tm_NN(primer[0:e-s+comp],nn_table=mt.DNA_NN2)
     # return final primer with tm
-    print(
-        "Generated primers: ",
-        primer.complement().reverse_complement(),
-        round(tm2, 1),
-        start,
-    )
+    if verbose:
+        print(
+            "Generated primers: ",
+            primer.complement().reverse_complement(),
+            round(tm2, 1),
+            start,
+        )
     return primer.complement().reverse_complement(), round(tm2, 1), start
 
 
@@ -499,10 +608,12 @@ def find_fragment_primer(fragment, stop):
         end = stop
     count = 0
     primer = fragment[start:end]
-    tm2 = mt.Tm_NN(
-        primer, nn_table=mt.DNA_NN2
+    fragmentNN2 = WindowTm(fragment, mt.DNA_NN2)
+    fragmentNN4 = WindowTm(fragment, mt.DNA_NN4)
+    tm2 = fragmentNN2.tm(
+        start, end
     )  # Two methods of finding melting temperature seems more consistent
-    tm4 = mt.Tm_NN(primer, nn_table=mt.DNA_NN4)
+    tm4 = fragmentNN4.tm(start, end)
     while (
         tm2 < DIMPLE.primerTm[0]
         or tm2 > DIMPLE.primerTm[1]
@@ -523,47 +634,52 @@ def find_fragment_primer(fragment, stop):
                 break
             end += 1
             primer = fragment[start:end]
-            tm2 = mt.Tm_NN(primer, nn_table=mt.DNA_NN2)
-            tm4 = mt.Tm_NN(primer, nn_table=mt.DNA_NN4)
+            tm2 = fragmentNN2.tm(start, end)
+            tm4 = fragmentNN4.tm(start, end)
 
         if tm2 > DIMPLE.primerTm[1] or tm4 > DIMPLE.primerTm[1]:
             end += -1
             primer = fragment[start:end]
-            tm2 = mt.Tm_NN(primer, nn_table=mt.DNA_NN2)
-            tm4 = mt.Tm_NN(primer, nn_table=mt.DNA_NN4)
+            tm2 = fragmentNN2.tm(start, end)
+            tm4 = fragmentNN4.tm(start, end)
     return primer, round(tm2, 1)
 
 
-def check_nonspecific(primer, fragment, point):
+def check_nonspecific(primer, fragment, point, index=None, log=None):
     non = []
     # fragment is the entire gene sequence plus the buffer sequence on each side
     # point is the position of the primer in the fragment
+    # index is an optional IndexWindow of the fragment (see DIMPLE.seq_index),
+    # only sites anchored at the 3' end of the primer are then checked,
+    # otherwise every position of the fragment is scanned
+    # matches found are printed or, if given a list as log, added to it
+
+    def report(message):
+        if log is None:
+            print(message)
+        else:
+            log.append(str(message))
+
+    primerCodes = encode_sequence(primer)
+    if index is not None:
+        sites = index.binding_sites(primerCodes)
+        forwardSites = sites.get((0, 0), [])
+        reverseSites = sites.get((0, 1), [])
+    else:
+        forwardSites = zip(*[x.tolist() for x in find_binding_sites(
+            primerCodes, encode_sequence(fragment)
+        )])
+        reverseSites = zip(*[x.tolist() for x in find_binding_sites(
+            primerCodes, encode_sequence(fragment.reverse_complement()), strict=True
+        )])
     # Forward
-    for i in range(len(fragment) - len(primer)):  # Scan each position
-        # first check if the primer binds at each position in the fragment
-        match = [
-            primer[j].lower() == fragment[i + j].lower() for j in range(len(primer))
-        ]
-        first = 10
-        for k in range(len(match) - 3):
-            if (match[k] and match[k + 1] and match[k + 3]) or (
-                match[k] and match[k + 1] and match[k + 2]
-            ):
-                first = k
-                break
-        # if the primer binds to 80% of the first ... bases
-        # and more than 6 bases
-        # and the 3' matches
-        # then check melting temperature
-        if (
-            sum(match[first:]) > len(primer[first:]) * 0.8
-            and sum(match[first:]) > 6
-            and match[-1]
-            and point != i
-        ):  # string compare - sum of matched nt is greater than 80%
+    # the primer binds to 80% of the bases after its first matching stretch,
+    # to more than 6 bases and with its 3' end (see filter_binding_sites)
+    for i, first in forwardSites:
+        if point != i:
             try:
                 # check the melting temperature of the primer
-                melt = mt.Tm_NN(
+                melt = Tm_NN(
                     primer[first:],
                     c_seq=fragment[i + first : i + len(primer)].complement(),
                     nn_table=mt.DNA_NN2,
@@ -571,40 +687,27 @@ def check_nonspecific(primer, fragment, point):
                     imm_table=mt.DNA_IMM1,
                 )
                 if melt > 25:
-                    print("Found non-specific match at " + str(i + 1) + "bp:")
-                    print("match: " + fragment[i: i + len(primer)])
-                    print("primer:" + primer + " Tm:" + str(round(melt, 1)))
+                    report("Found non-specific match at " + str(i + 1) + "bp:")
+                    report("match: " + fragment[i: i + len(primer)])
+                    report("primer:" + primer + " Tm:" + str(round(melt, 1)))
                 if melt > 35:
                     non.append(True)
             except ValueError as valerr:
-                print(
+                report(
                     str(valerr)
                     + ". Please check position manually:"
                     + str(i + 1)
                     + " forward"
                 )
-                print("Primer:" + primer)
-                print("Match: " + fragment[i : i + len(primer)])
+                report("Primer:" + primer)
+                report("Match: " + fragment[i : i + len(primer)])
                 non.append(False)
     # Reverse
     fragment = fragment.reverse_complement()
-    for i in range(len(fragment) - len(primer)):
-        match = [
-            primer[j].lower() == fragment[i + j].lower() for j in range(len(primer))
-        ]
-        first = 10
-        for k in range(0, len(match) - 3, 1):
-            if match[k] and match[k + 1] and match[k + 3]:
-                first = k
-                break
-        if (
-            sum(match[first:]) > len(primer[first:]) * 0.8
-            and sum(match[first:]) > 6
-            and match[-1]
-            and point != -i
-        ):  # string compare - sum of matched nt is greater than 80%
+    for i, first in reverseSites:
+        if point != -i:
             try:
-                melt = mt.Tm_NN(
+                melt = Tm_NN(
                     primer[first:],
                     c_seq=fragment[i + first : i + len(primer)].complement(),
                     nn_table=mt.DNA_NN2,
@@ -612,24 +715,83 @@ def check_nonspecific(primer, fragment, point):
                     imm_table=mt.DNA_IMM1,
                 )
                 if melt > 20:
-                    print("Found non-specific match at " + str(i + 1) + "bp:")
-                    print(" match:" + fragment[i : i + len(primer)])
-                    print("primer:" + primer + " Tm:" + str(melt))
+                    report("Found non-specific match at " + str(i + 1) + "bp:")
+                    report(" match:" + fragment[i : i + len(primer)])
+                    report("primer:" + primer + " Tm:" + str(melt))
                 if melt > 35:
                     non.append(True)
             except ValueError as valerr:
-                print(
+                report(
                     str(valerr)
                     + ". Please check position manually:"
                     + str(i + 1)
                     + " reverse"
                 )
-                print("Primer:" + primer)
-                print("Match: " + fragment[i : i + len(primer)])
+                report("Primer:" + primer)
+                report("Match: " + fragment[i : i + len(primer)])
                 non.append(False)
     return sum(non)
 
 
+class PrimerTable:
+    """Gene primers of a gene for a pair of overlaps, searched on first lookup.
+
+    Maps ("R", breaksite) and ("F", breaksite) to the result of find_gene_primer,
+    kept in the gene's primerCache (see DIMPLE.gene_primer). Only breaksites that
+    are looked up are searched. Breaksites too close to an end of the gene
+    sequence for the primer window have no primer: get returns the default and
+    indexing raises KeyError.
+    """
+
+    def __init__(self, gene, overlapL, overlapR):
+        self.gene = gene
+        self.overlaps = {"R": overlapL, "F": overlapR}
+
+    def get(self, key, default=None):
+        direction, breaksite = key
+        if (
+            breaksite - DIMPLE.primerBuffer < 0
+            or breaksite + DIMPLE.primerBuffer > len(self.gene.seq)
+        ):
+            return default
+        return self.gene.gene_primer(direction, breaksite, self.overlaps[direction])
+
+    def __getitem__(self, key):
+        primer = self.get(key)
+        if primer is None:
+            raise KeyError(key)
+        return primer
+
+
+def find_gene_primer(gene, direction, breaksite, overlap):
+    """Find the gene primer at a breaksite and check it for nonspecific binding.
+
+    direction is "R" for the primer at the start of a fragment and "F" for the
+    primer at its end. Nothing is printed, the messages of check_nonspecific
+    are returned instead.
+    Returns the primer, its Tm, its start, the check_nonspecific result and
+    the messages.
+    """
+    genefrag = gene.seq[
+        breaksite - DIMPLE.primerBuffer: breaksite + DIMPLE.primerBuffer
+    ]
+    # negative numbers look for reverse primers
+    # 10 bases is the buffer overhang on the primer (ATA + (N))
+    if direction == "R":
+        primer, tm, start = find_geneprimer(
+            genefrag, 15, DIMPLE.primerBuffer + 1 - overlap, False
+        )  # 15 is just a starting point
+        point = breaksite - len(gene.seq) + 3 + len(DIMPLE.cutsite_buffer) + len(DIMPLE.cutsite) - overlap
+    else:
+        primer, tm, start = find_geneprimer(
+            genefrag.reverse_complement(), 15, DIMPLE.primerBuffer + 1 - overlap, False
+        )
+        point = breaksite - 3 - len(DIMPLE.cutsite_buffer) - len(DIMPLE.cutsite) + overlap
+    messages = []
+    nonspecific = check_nonspecific(primer, gene.seq, point, gene.seq_index(), messages)
+    return primer, tm, start, nonspecific, messages
+
+
 def recalculate_num_fragments(gene):
     num = int(
         round(((gene.end - gene.start) / float(gene.maxfrag)) + 0.499999999)
@@ -670,6 +832,14 @@ def switch_fragmentsize(gene, detectedsite, OLS):
     count = 0
     count2 = 0
     print("Non specific Fragment:" + str(detectedsite))
+    if DIMPLE.plan_fragments and not gene.linked and 0 < detectedsite < len(gene.fragsize):
+        # plan all breaksites again without this one instead of shifting it
+        gene.problemsites.add(gene.breaksites[detectedsite])
+        breaksites = plan_breaksites(gene, *gene.overlaps)
+        if breaksites is not None:
+            gene.breaksites = breaksites
+            print(gene.fragsize)
+            return skip
     if (
         len(gene.fragsize) * gene.maxfrag < len(gene.seq) - gene.primerBuffer * 2
     ):  # if the maxfrag has changed and it is impossible to split the gene into x number of fragments it should recalculate the number of fragments
@@ -815,6 +985,235 @@ def switch_fragmentsize(gene, detectedsite, OLS):
     return skip
 
 
+class OverhangRegistry:
+    """Overhangs used by the fragment ends of a gene and its linked genes.
+
+    Each overhang is stored with the fragment ends, (gene, fragment, "F" or "R"),
+    that use it. gene is the index of the gene in its ConstraintTracker. Finding
+    the ends that use an overhang or its reverse complement is then a dictionary
+    lookup.
+    """
+
+    def __init__(self):
+        self.ends = {}
+
+    def add(self, overhang, end):
+        self.ends.setdefault(str(overhang), Counter())[end] += 1
+
+    def discard(self, overhang, end):
+        ends = self.ends[str(overhang)]
+        ends[end] -= 1
+        if ends[end] <= 0:
+            del ends[end]
+        if not ends:
+            del self.ends[str(overhang)]
+
+    def users(self, overhang):
+        """Return the fragment ends using an overhang or its reverse complement."""
+        users = set(self.ends.get(str(overhang), ()))
+        users.update(self.ends.get(str(overhang.reverse_complement()), ()))
+        return users
+
+
+TrackedFragment = namedtuple("TrackedFragment", ["overhangs", "nonspecificR", "nonspecificF"])
+TrackedFragment.__doc__ = """Overhangs of a fragment in each gene and whether its gene primers are nonspecific."""
+
+
+class ConstraintTracker:
+    """Constraint status of every fragment of a gene, kept up to date as breaksites move.
+
+    Fragment i only depends on breaksites i and i+1, so after breaksites move only
+    the fragments next to them are checked again. Each fragment records its
+    forward and reverse overhangs in the gene and its linked genes (also kept in
+    an OverhangRegistry) and whether its gene primers are nonspecific (see
+    PrimerTable). Fragments checked again are
+    added to unchecked until the caller has validated them.
+    """
+
+    def __init__(self, gene, overlapL, overlapR, linked=()):
+        self.gene = gene
+        self.genes = [gene] + list(linked)  # linked genes share the breaksites
+        self.overlapL = overlapL
+        self.overlapR = overlapR
+        self.breaksites = []
+        self.fragments = []
+        self.overhangs = OverhangRegistry()
+        self.unchecked = set()  # indexes of fragments that changed since they were validated
+
+    def check_fragment(self, start, end):
+        overhangs = []
+        for gene in self.genes:
+            # TODO: remove hardcoded 4 to allow different overhang lengths
+            overhang_F = gene.seq[
+                start - DIMPLE.cutsite_overhang - self.overlapL: start - self.overlapR
+            ]  # Forward overhang
+            overhang_R = gene.seq[
+                end + self.overlapL: end + DIMPLE.cutsite_overhang + self.overlapR
+            ]  # Reverse overhang
+            overhangs.append((overhang_F, overhang_R))
+        table = self.gene.primer_table(self.overlapL, self.overlapR)
+        return TrackedFragment(
+            overhangs, bool(table[("R", start)][3]), bool(table[("F", end)][3])
+        )
+
+    def update(self):
+        """Check the fragments whose breaksites changed and return their indexes."""
+        breaksites = list(self.gene.breaksites)
+        fragments = []
+        changed = []
+        for idx, (start, end) in enumerate(zip(breaksites[:-1], breaksites[1:])):
+            if self.breaksites[idx: idx + 2] == [start, end]:
+                fragments.append(self.fragments[idx])
+            else:
+                fragments.append(self.check_fragment(start, end))
+                changed.append(idx)
+        for idx, fragment in enumerate(self.fragments):
+            if idx in changed or idx >= len(fragments):
+                for gene, (overhang_F, overhang_R) in enumerate(fragment.overhangs):
+                    self.overhangs.discard(overhang_F, (gene, idx, "F"))
+                    self.overhangs.discard(overhang_R, (gene, idx, "R"))
+        for idx in changed:
+            for gene, (overhang_F, overhang_R) in enumerate(fragments[idx].overhangs):
+                self.overhangs.add(overhang_F, (gene, idx, "F"))
+                self.overhangs.add(overhang_R, (gene, idx, "R"))
+        self.breaksites = breaksites
+        self.fragments = fragments
+        self.unchecked = {idx for idx in self.unchecked if idx < len(fragments)}
+        self.unchecked.update(changed)
+        return changed
+
+    def overhang_conflicts(self):
+        """Indexes of fragments whose first breaksite has to move to fix an overhang.
+
+        A fragment conflicts if its forward and reverse overhangs in the same gene
+        match (or are reverse complements). With DIMPLE.unique_overhangs every
+        overhang that can move must also differ from the overhangs of all other
+        fragment ends of the gene and its linked genes, and not be palindromic.
+        The reverse overhang of a fragment moves with the first breaksite of the
+        next fragment.
+        """
+        self.update()
+        conflicts = []
+        last = len(self.fragments) - 1
+        for idx, fragment in enumerate(self.fragments):
+            for gene, (overhang_F, overhang_R) in enumerate(fragment.overhangs):
+                if DIMPLE.unique_overhangs:
+                    # linked genes share their fragment ends
+                    if idx and (
+                        {end[1:] for end in self.overhangs.users(overhang_F)} - {(idx, "F")}
+                        or overhang_F == overhang_F.reverse_complement()
+                    ):
+                        conflicts.append(idx)
+                    if idx < last and (
+                        {end[1:] for end in self.overhangs.users(overhang_R)} - {(idx, "R")}
+                        or overhang_R == overhang_R.reverse_complement()
+                    ):
+                        conflicts.append(idx + 1)
+                elif (gene, idx, "R") in self.overhangs.users(overhang_F):
+                    conflicts.append(idx)
+        return sorted(set(conflicts))
+
+
+def plan_breaksites(gene, overlapL=None, overlapR=None):
+    """Choose all breaksites of a gene at once.
+
+    Breaksites are picked from the codon grid between the first and last
+    breaksite by dynamic programming over the number of fragments. The plan has
+    the fewest fragments with sizes between DIMPLE.minfrag and gene.maxfrag and,
+    among those, the most even sizes (smallest sum of squared sizes). Inner
+    breaksites avoid gene.problemsites. Given the overlaps, every fragment also
+    passes check_overhangs and its gene primers are specific (see primer_table).
+    With DIMPLE.unique_overhangs, palindromic overhangs are avoided and the
+    inner breaksites of overhangs shared between fragments are pruned before
+    planning again, until every overhang of the plan is unique.
+    Returns the breaksites or None if no plan exists.
+    """
+    sites = np.arange(gene.breaksites[0], gene.breaksites[-1] + 1, 3)
+    count = len(sites)
+    inner = np.array([x not in gene.problemsites for x in sites.tolist()])
+    inner[0] = inner[-1] = True  # the ends of the gene can not be moved
+    start = inner.copy()  # sites that can start a fragment
+    end = inner.copy()  # sites that can end a fragment
+    overhangs = overlapL is not None and overlapR is not None
+    if overhangs:
+        table = gene.primer_table(overlapL, overlapR)
+        for idx, site in enumerate(sites.tolist()):
+            primer = table.get(("R", site))
+            if idx and (primer is None or primer[3]):
+                start[idx] = False
+            primer = table.get(("F", site))
+            if idx < count - 1 and (primer is None or primer[3]):
+                end[idx] = False
+        overhangId = {}
+        overhangF = [gene.seq[x - DIMPLE.cutsite_overhang - overlapL: x - overlapR] for x in sites.tolist()]
+        overhangR = [gene.seq[x + overlapL: x + DIMPLE.cutsite_overhang + overlapR] for x in sites.tolist()]
+        if DIMPLE.unique_overhangs:
+            # palindromic overhangs ligate to themselves
+            start[1:] &= np.array([x != x.reverse_complement() for x in overhangF[1:]])
+            end[:-1] &= np.array([x != x.reverse_complement() for x in overhangR[:-1]])
+        overhangRC = np.array([
+            overhangId.setdefault(str(x.reverse_complement()), len(overhangId)) for x in overhangR
+        ])
+        overhangFC = np.array([
+            overhangId.setdefault(str(x.reverse_complement()), len(overhangId)) for x in overhangF
+        ])
+        overhangF = np.array([overhangId.setdefault(str(x), len(overhangId)) for x in overhangF])
+        overhangR = np.array([overhangId.setdefault(str(x), len(overhangId)) for x in overhangR])
+    steps = range(max(1, -(-DIMPLE.minfrag // 3)), gene.maxfrag // 3 + 1)  # fragment sizes in codons
+    while True:
+        cost = np.full(count, np.inf)  # smallest sum of squared sizes to reach each site
+        cost[0] = 0
+        choices = []  # size of the last fragment to reach each site, for each number of fragments
+        while not np.isfinite(cost[-1]):
+            if not np.isfinite(cost).any():
+                return None
+            reached = np.full(count, np.inf)
+            choice = np.zeros(count, dtype=np.int64)
+            for step in steps:
+                if step >= count:
+                    break
+                valid = start[:-step] & end[step:]
+                if overhangs:
+                    valid &= (overhangF[:-step] != overhangR[step:]) & (
+                        overhangF[:-step] != overhangRC[step:]
+                    )
+                total = np.where(valid, cost[:-step] + (3 * step) ** 2, np.inf)
+                better = total < reached[step:]
+                reached[step:][better] = total[better]
+                choice[step:][better] = step
+            choices.append(choice)
+            cost = reached
+        plan = [count - 1]
+        for choice in reversed(choices):
+            plan.append(plan[-1] - choice[plan[-1]])
+        plan = plan[::-1]
+        if not (overhangs and DIMPLE.unique_overhangs):
+            break
+        # the plan only compares the two ends of each fragment, inner breaksites
+        # of overhangs used by other fragment ends are pruned and planned again
+        used = {}  # overhang to the site of the first fragment end using it
+        conflicts = set()
+        for position, idx in enumerate(plan):
+            ends = []
+            if position < len(plan) - 1:
+                ends.append((overhangF[idx], overhangFC[idx]))
+            if position:
+                ends.append((overhangR[idx], overhangRC[idx]))
+            for overhang, reverse in ends:
+                other = used.get(overhang, used.get(reverse))
+                if other is not None:
+                    conflicts.add(idx if 0 < position < len(plan) - 1 else other)
+                used.setdefault(overhang, idx)
+        conflicts.discard(0)  # the ends of the gene can not be moved
+        conflicts.discard(count - 1)
+        if not conflicts:
+            break
+        conflicts = sorted(conflicts)
+        start[conflicts] = False
+        end[conflicts] = False
+    return [int(sites[idx]) for idx in plan]
+
+
 def check_overhangs(gene, OLS, overlapL, overlapR):
     """TODO:
     Docstring
@@ -823,21 +1222,10 @@ def check_overhangs(gene, OLS, overlapL, overlapR):
     switched = False
     if not isinstance(gene, DIMPLE):
         raise TypeError("Not an instance of the DIMPLE class")
+    tracker = gene.constraint_tracker(overlapL, overlapR, OLS)
     while True:
-        detectedsites = set()  # stores matching overhangs
-        for idx, y in enumerate(gene.breaklist):
-            # TODO: remove hardcoded 4 to allow different overhang lengths
-            overhang_F = gene.seq[
-                y[0] - DIMPLE.cutsite_overhang - overlapL: y[0] - overlapR
-            ]  # Forward overhang
-            overhang_R = gene.seq[
-                y[1] + overlapL: y[1] + DIMPLE.cutsite_overhang + overlapR
-            ]  # Reverse overhang
-            if (
-                overhang_F == overhang_R
-                or overhang_F == overhang_R.reverse_complement()
-            ):
-                detectedsites.update([idx])
+        # only fragments next to moved breaksites are checked again
+        detectedsites = set(tracker.overhang_conflicts())  # stores matching overhangs
         # overhang = []
         # for idx, y in enumerate(gene.breaklist):
         #     overhang.append([gene.seq[y[0] - DIMPLE.cutsite_overhang - overlapL: y[0] - overlapR], idx])  # Forward overhang
@@ -860,6 +1248,137 @@ def check_overhangs(gene, OLS, overlapL, overlapR):
             break
     return switched
 
+FragmentPlan = namedtuple("FragmentPlan", ["breaksites", "breaklist", "overhangs", "genePrimers"])
+FragmentPlan.__doc__ = """Validated fragments of a gene, built before any variant is generated."""
+
+
+def fragment_range(frag):
+    """Return the first and last amino acid of a fragment as strings."""
+    # AA range for fragment (need to subtract beginning primer buffer)
+    fragstart = str(int((frag[0] - DIMPLE.primerBuffer) / 3) + 2) # jossie changed index to be one less. then changed back
+    fragend = str(int((frag[1] - DIMPLE.primerBuffer) / 3) + 1) # jossie changed index to be one less. then changed back
+    return fragstart, fragend
+
+
+def plan_gene_fragments(gene, OLS, overlapL, overlapR):
+    """Fix the breaksites, gene primers and overhangs of a gene.
+
+    Breaksites are moved until every gene primer is specific (or at an end of
+    the gene) and no overhangs match. Gene primers come from the primer table and
+    after a move only the fragments next to it are validated again (see
+    ConstraintTracker). Returns a FragmentPlan.
+    """
+    if not isinstance(gene, DIMPLE):
+        raise TypeError("Not an instance of the DIMPLE class")
+    # Gene primers are searched as breaksites are used, boundaries found with
+    # nonspecific primers are added to problemsites by switch_fragmentsize
+    primerTable = gene.primer_table(overlapL, overlapR)
+    if DIMPLE.plan_fragments and not gene.linked:
+        gene.overlaps = (overlapL, overlapR)
+        breaksites = plan_breaksites(gene, overlapL, overlapR)
+        if breaksites is None:
+            print("No fragment plan found for " + gene.geneid + ". Adjusting fragments one at a time")
+        elif breaksites != gene.breaksites:
+            gene.breaksites = breaksites
+    # Quality Control for overhangs from the same gene
+    check_overhangs(gene, OLS, overlapL, overlapR)
+    tracker = gene.constraint_tracker(overlapL, overlapR, OLS)
+    tracker.update()
+    last = len(tracker.fragments) - 1
+    while True:
+        # only fragments next to moved breaksites are validated again
+        while tracker.unchecked:
+            idx = min(tracker.unchecked)
+            tracker.unchecked.discard(idx)
+            fragment = tracker.fragments[idx]
+            frag = gene.breaklist[idx]
+            # primers at the ends of the gene can not move, they are extended below
+            nonspecificF = fragment.nonspecificF and idx < last
+            nonspecificR = fragment.nonspecificR and idx > 0
+            if not (nonspecificF or nonspecificR):
+                continue
+            reverse, tmR, sR, tmpr, messagesR = primerTable[("R", frag[0])]
+            forward, tmF, sF, tmpf, messagesF = primerTable[("F", frag[1])]
+            for message in messagesR + messagesF:
+                print(message)
+            # swap size with another fragment
+            print(
+                "------------------ Fragment size swapped due to non-specific primers ------------------"
+            )
+            if nonspecificF:
+                print("Non specific primer F: " + forward)
+                switch_fragmentsize(gene, idx + 1, OLS)
+            else:
+                print("Non specific primer R: " + reverse)
+                switch_fragmentsize(gene, idx, OLS)
+            tracker.update()
+            last = len(tracker.fragments) - 1
+        if not check_overhangs(gene, OLS, overlapL, overlapR):
+            break
+    genePrimer = []
+    for idx, frag in enumerate(gene.breaklist):
+        fragstart, fragend = fragment_range(frag)
+        # Primers for gene amplification with addition of restriction enzyme site
+        reverse, tmR, sR, tmpr, messagesR = primerTable[("R", frag[0])]
+        forward, tmF, sF, tmpf, messagesF = primerTable[("F", frag[1])]
+        print("Generated primers: ", reverse, tmR, sR)
+        print("Generated primers: ", forward, tmF, sF)
+        for message in messagesR + messagesF:
+            print(message)
+        # nonspecific primers left could not be moved (end of gene), try to make them more specific
+        if tmpr:
+            genefrag_R = gene.seq[
+                frag[0] - DIMPLE.primerBuffer: frag[0] + DIMPLE.primerBuffer
+            ]
+            reverse += gene.complement[genefrag_R[sR - 1]]
+            warnings.warn(
+                "Gene primer at the end of gene has non specific annealing. Please Check this primer manually: " + str(reverse)
+            )
+        if tmpf:
+            genefrag_F = gene.seq[
+                frag[1] - DIMPLE.primerBuffer: frag[1] + DIMPLE.primerBuffer
+            ]
+            forward += Seq(
+                genefrag_F.reverse_complement()[sF - 1]
+            ).reverse_complement()
+            warnings.warn(
+                "Gene primer at the end of gene has non specific annealing. Please Check this primer manually: " + str(forward)
+            )
+        # Store
+        genePrimer.append(
+            SeqRecord(
+                reverse,
+                id=gene.geneid + "_geneP_Mut-" + str(idx + 1) + "_R",
+                description="Frag"
+                + fragstart
+                + "-"
+                + fragend
+                + " "
+                + str(tmR)
+                + "C",
+            )
+        )
+        genePrimer.append(
+            SeqRecord(
+                forward,
+                id=gene.geneid + "_geneP_Mut-" + str(idx + 1) + "_F",
+                description="Frag"
+                + fragstart
+                + "-"
+                + fragend
+                + " "
+                + str(tmF)
+                + "C",
+            )
+        )
+    return FragmentPlan(
+        tuple(gene.breaksites),
+        tuple(tuple(frag) for frag in gene.breaklist),
+        tuple(tuple(fragment.overhangs[0]) for fragment in tracker.fragments),
+        tuple(genePrimer),
+    )
+
+
 def split_to_codons(seq):
     ''' Split a sequence into codons.
     Input: Coding sequence (Seq object or string)
@@ -867,6 +1386,247 @@ def split_to_codons(seq):
     '''
     return [seq[i: i + 3] for i in range(0, len(seq), 3)]
 
+class OligoStream:
+    """List-like store of oligos that writes each oligo to FASTA files when appended.
+
+    The oligos are written to path and to any other open handles (the combined
+    All_Oligos.fasta) instead of being kept in memory. Iterating reads them back
+    from path.
+    """
+
+    def __init__(self, path, *handles):
+        self.path = path
+        self.handle = open(path, "w")
+        self.writers = [FastaWriter(x) for x in (self.handle,) + handles]
+        self.count = 0
+
+    def append(self, record):
+        for writer in self.writers:
+            writer.write_record(record)
+        self.count += 1
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        if not self.handle.closed:
+            self.handle.flush()
+        return SeqIO.parse(self.path, "fasta")
+
+
+def reservoir_sample(items, k, rng):
+    """Pick k items of an iterable of unknown length, each equally likely, keeping their order.
+
+    Uses Algorithm L, which draws how many items to skip between replacements,
+    so only O(k log(n/k)) random numbers are drawn and k items are kept.
+    """
+    items = enumerate(items)
+    reservoir = list(itertools.islice(items, k))
+    if len(reservoir) == k and k:
+        w = np.exp(np.log(1 - rng.random()) / k)
+        while True:
+            skip = int(np.floor(np.log(1 - rng.random()) / np.log(1 - w)))
+            item = next(itertools.islice(items, skip, None), None)
+            if item is None:
+                break
+            reservoir[rng.integers(k)] = item
+            w *= np.exp(np.log(1 - rng.random()) / k)
+    return [item for position, item in sorted(reservoir, key=lambda x: x[0])]
+
+
+def double_mutants(seq, substitutions, count=0, window=0, rng=None):
+    """Yield (first, second, sequence) for the double mutants of a fragment.
+
+    substitutions maps the name of each substitution to its (offset in seq, codon).
+    Pairs of substitutions at different codons (without stop codons) are made in
+    order. With window only pairs within that many codons of each other are made,
+    with count only that many pairs, picked with reservoir_sample from rng.
+    """
+    pairs = (
+        (first, second)
+        for first, second in itertools.combinations(substitutions, 2)
+        if "STOP" not in first
+        and "STOP" not in second
+        and substitutions[first][0] != substitutions[second][0]
+        and (not window or abs(substitutions[first][0] - substitutions[second][0]) <= 3 * window)
+    )
+    if count:
+        pairs = reservoir_sample(pairs, count, rng)
+    for first, second in pairs:
+        (pos1, codon1), (pos2, codon2) = sorted([substitutions[first], substitutions[second]])
+        yield first, second, seq[0:pos1] + codon1 + seq[pos1 + 3: pos2] + codon2 + seq[pos2 + 3:]
+
+
+class FrameStops:
+    """Counts the stops in the coding part of in-frame indel variants of a fragment.
+
+    The coding part of the wild type fragment (fragment[start:stop], read from
+    start) is translated once and its stops are counted for every codon prefix.
+    An edit replacing deleted bases at offset with inserted only changes the
+    codons it touches, so only those are translated. Frameshifts and edits
+    reaching outside the whole codons of the coding part translate the variant.
+    """
+
+    codonStops = {}  # whether each codon seen translates to a stop
+
+    def __init__(self, fragment, start, stop):
+        self.fragment = str(fragment)
+        self.start = start
+        self.stop = stop
+        self.full = start + (stop - start) // 3 * 3  # end of the last whole codon
+        protein = str(Seq(self.fragment[start:self.full]).translate())
+        self.prefix = list(itertools.accumulate((aa == "*" for aa in protein), initial=0))
+
+    def is_stop(self, codon):
+        if codon not in FrameStops.codonStops:
+            FrameStops.codonStops[codon] = str(Seq(codon).translate()) == "*"
+        return FrameStops.codonStops[codon]
+
+    def count(self, offset, deleted, inserted=""):
+        """Number of stops in the coding part of the variant, as counted by translate."""
+        inserted = str(inserted)
+        end = offset + deleted
+        if (len(inserted) - deleted) % 3 or offset < self.start or end > self.full:
+            variant = self.fragment[:offset] + inserted + self.fragment[end:]
+            tail = len(self.fragment) - self.stop
+            return str(Seq(variant[self.start:len(variant) - tail]).translate()).count("*")
+        first = (offset - self.start) // 3  # codons touched by the edit
+        last = -(-(end - self.start) // 3)
+        junction = (
+            self.fragment[self.start + 3 * first:offset]
+            + inserted
+            + self.fragment[end:self.start + 3 * last]
+        )
+        stops = self.prefix[first] + self.prefix[-1] - self.prefix[last]
+        for k in range(0, len(junction), 3):
+            stops += self.is_stop(junction[k:k + 3])
+        return stops
+
+
+class SiteChecker:
+    """Counts the sequences to avoid (DIMPLE.avoid_sequence) in variants of a fragment.
+
+    Patterns and their reverse complements are prepared once. If the wild type
+    fragment has none of them, a new site in a variant has to overlap the edited
+    bases, so only the edit and the pattern length - 1 bases on either side of
+    it are searched.
+    """
+
+    def __init__(self, sequences):
+        self.patterns = [
+            (str(x).upper(), str(x.reverse_complement()).upper()) for x in sequences
+        ]
+        self.reach = max([len(x) for x, rc in self.patterns], default=1) - 1
+        self.windowed = False
+
+    def set_fragment(self, seq):
+        """Set the wild type fragment that the following variants are edited from."""
+        self.windowed = not self.found(seq)
+
+    def counts(self, seq):
+        """Count each pattern (both strands) in seq."""
+        seq = str(seq).upper()
+        return [seq.count(x) + seq.count(rc) for x, rc in self.patterns]
+
+    def found(self, seq, limit=0):
+        """Return True if any pattern is found more than limit times."""
+        return any(x > limit for x in self.counts(seq))
+
+    def found_variant(self, variant, limit=0):
+        """Same as found for the sequence of a Variant of the current fragment."""
+        if not self.windowed:
+            return self.found(variant.seq, limit)
+        end = variant.offset + variant.deleted
+        return self.found(
+            str(variant.fragment[max(0, variant.offset - self.reach): variant.offset])
+            + str(variant.inserted)
+            + str(variant.fragment[end: end + self.reach]),
+            limit,
+        )
+
+
+class Variant:
+    """Compact record of a variant of a fragment, used in place of a SeqRecord.
+
+    Only the edit is stored, the deleted bases at offset of the wild type
+    fragment (shared by all of its variants) are replaced by inserted. The id is
+    <geneid>_<kind>-<number>_<name>. The sequence and the id are built when read.
+    """
+
+    __slots__ = (
+        "fragment", "offset", "deleted", "inserted", "geneid", "kind", "number", "name", "description"
+    )
+
+    def __init__(self, fragment, offset, deleted, inserted, geneid, kind, number, name, description=""):
+        self.fragment = fragment
+        self.offset = offset
+        self.deleted = deleted
+        self.inserted = inserted
+        self.geneid = geneid
+        self.kind = kind
+        self.number = number
+        self.name = name
+        self.description = description
+
+    @property
+    def seq(self):
+        return (
+            self.fragment[:self.offset]
+            + self.inserted
+            + self.fragment[self.offset + self.deleted:]
+        )
+
+    @property
+    def id(self):
+        return self.geneid + "_" + self.kind + "-" + str(self.number) + "_" + self.name
+
+    def __len__(self):
+        return len(self.fragment) - self.deleted + len(self.inserted)
+
+    def record(self):
+        """Return the variant as a SeqRecord."""
+        return SeqRecord(self.seq, id=self.id, description=self.description)
+
+
+class MutationManifest:
+    """Buffered writer for the <gene>_mutations.csv file of a gene.
+
+    Every variant takes two lines, its name and the bases it adds to the gene
+    (the removed bases for deletions).
+    Substitutions are named as before (>Ala12Gly), other variants by their oligo
+    id without the gene name. The file is truncated when opened and closed when
+    used as a context manager.
+    """
+
+    def __init__(self, path, geneid, buffering=1 << 16):
+        self.handle = open(path, "w", buffering=buffering)
+        self.geneid = geneid
+
+    def write(self, name, bases):
+        self.handle.write(name + "\n" + str(bases) + "\n")
+
+    def add_variant(self, record, bases):
+        self.write(">" + record.id[len(self.geneid) + 1:], bases)
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 def generate_DMS_fragments(
     OLS, overlapL, overlapR, synonymous, custom_mutations, dms=True, insert=False, duplicate=False, delete=False, dis=False, folder=""
 ):
@@ -879,7 +1639,6 @@ def generate_DMS_fragments(
     if not isinstance(OLS[0], DIMPLE):
         raise TypeError("Not an instance of the DIMPLE class")
     # Loop through each gene or gene variation
-    finishedGenes = []
     # Adjust fragments to account for variable sized fragments with the same subpool barcodes/primers
     if insert or duplicate or delete or dis:
         insert_list = []
@@ -908,7 +1667,8 @@ def generate_DMS_fragments(
         print("New max fragment:" + str(DIMPLE.maxfrag))
         for gene in OLS:
             switch_fragmentsize(gene, 1, OLS)
-    # Generate oligos for each gene
+    # Plan the fragments of every gene before generating any variants
+    plans = {}
     for ii, gene in enumerate(OLS):
         print(gene.breaklist)
         print(
@@ -920,634 +1680,408 @@ def generate_DMS_fragments(
         # gene.fragsize[0] += -3  # Adjust size to match breaklist
         gene.maxfrag = DIMPLE.maxfrag
         if not any(
-            [tmp in finishedGenes for tmp in gene.linked]
+            [tmp in plans for tmp in gene.linked]
         ):  # only run analysis for one of the linked genes
-            # Quality Control for overhangs from the same gene
-            check_overhangs(gene, OLS, overlapL, overlapR)
-        # Generate oligos and Primers
-        idx = 0  # index for fragment
-        totalcount = 0
-        # storage for unused barcodes
-        compileF = []
-        compileR = []
-        missingSites = []
-        offset_list = []
-        # missingTable = [[1]*gene.aacount]*gene.aacount
-        missingFragments = []
-        all_grouped_oligos = []
-        uniquefrag_set = set()
-        truncfrag_set = set()
-        stop_codons = gene.SynonymousCodons["STOP"]
-        # Loop through each fragment
-        while idx < len(gene.breaklist):
-            if idx == 0:
-                gene.oligos = []
-                gene.barPrimer = []
-                gene.genePrimer = []
-            frag = gene.breaklist[idx]
-            grouped_oligos = []
-            # AA range for fragment (need to subtract beginning primer buffer)
-            fragstart = str(int((frag[0] - DIMPLE.primerBuffer) / 3) + 2) # jossie changed index to be one less. then changed back
-            fragend = str(int((frag[1] - DIMPLE.primerBuffer) / 3) + 1) # jossie changed index to be one less. then changed back
+            plans[ii] = plan_gene_fragments(gene, OLS, overlapL, overlapR)
+    siteChecker = SiteChecker(DIMPLE.avoid_sequence)
+    # Generate oligos for each gene
+    with contextlib.ExitStack() as outputs:
+        # files written while generating are closed even if a gene fails
+        if DIMPLE.stream_oligos:
+            # every oligo is written as it is made, print_all only writes the primers
+            allOligos = outputs.enter_context(
+                open(os.path.join(folder.replace("\\", ""), "All_Oligos.fasta"), "w")
+            )
+        for ii, gene in enumerate(OLS):
+            if ii in plans:
+                plan = plans[ii]
+            else:  # linked genes share the breaksites of the planned gene
+                plan = FragmentPlan(
+                    tuple(gene.breaksites),
+                    tuple(tuple(frag) for frag in gene.breaklist),
+                    (),
+                    (),
+                )
+            gene.fragmentPlan = plan
             print(
-                "Creating Fragment:"
+                "--------------------------------- Generating Oligos:"
                 + gene.geneid
-                + " --- Fragment #" + str(idx+1) + " AA:"
-                + fragstart
-                + "-"
-                + fragend
+                + " ---------------------------------"
             )
-            # only run analysis for one of the linked genes
-            if not any(
-                [tmp in finishedGenes for tmp in gene.linked]
-            ):
-                # Primers for gene amplification with addition of restriction enzyme site
-                genefrag_R = gene.seq[
-                    frag[0] - DIMPLE.primerBuffer: frag[0] + DIMPLE.primerBuffer
-                ]
-                reverse, tmR, sR = find_geneprimer(
-                    genefrag_R, 15, DIMPLE.primerBuffer + 1 - overlapL
-                )  # 15 is just a starting point
-                genefrag_F = gene.seq[
-                    frag[1] - DIMPLE.primerBuffer: frag[1] + DIMPLE.primerBuffer
-                ]
-                forward, tmF, sF = find_geneprimer(
-                    genefrag_F.reverse_complement(),
-                    15,
-                    DIMPLE.primerBuffer + 1 - overlapR
-                )
-                # negative numbers look for reverse primers
-                # 10 bases is the buffer overhang on the primer (ATA + (N))
-                tmpr = check_nonspecific(reverse, gene.seq, frag[0] - len(gene.seq) + 3 + len(DIMPLE.cutsite_buffer) + len(DIMPLE.cutsite) - overlapL)
-                tmpf = check_nonspecific(forward, gene.seq, frag[1] - 3 - len(DIMPLE.cutsite_buffer) - len(DIMPLE.cutsite) + overlapR)
-                if tmpf or tmpr:
-                    # swap size with another fragment
-                    print(
-                        "------------------ Fragment size swapped due to non-specific primers ------------------"
-                    )
-                    if tmpf:
-                        idx = idx + 1
-                        print("Non specific primer F: " + forward)
-                    else:
-                        print("Non specific primer R: " + reverse)
-                    # swap size with another fragment
-                    skip = switch_fragmentsize(gene, idx, OLS)
-                    if skip:
-                        # if end of gene, try to extend primer to make it more specific?
-                        if tmpr:
-                            reverse += gene.complement[genefrag_R[sR - 1]]
-                            warnings.warn(
-                                "Gene primer at the end of gene has non specific annealing. Please Check this primer manually: " + str(reverse)
-                            )
-                        if tmpf:
-                            idx -= 1
-                            forward += Seq(
-                                genefrag_F.reverse_complement()[sF - 1]
-                            ).reverse_complement()
-                            warnings.warn(
-                                "Gene primer at the end of gene has non specific annealing. Please Check this primer manually: " + str(forward)
-                            )
-                    else:
-                        # Quality Control for overhangs from the same gene
-                        # check_overhangs(gene, OLS)
-                        DIMPLE.barcodeF.extend(compileF)  # return unused barcodes
-                        DIMPLE.barcodeR.extend(compileR)
-                        compileF = []  # reset unused primers
-                        compileR = []
-                        gene.genePrimer = (
-                            []
-                        )  # reset gene all primers due to nonspecific primer
-                        gene.barPrimer = []
-                        idx = 0
-                        continue  # return to the beginning
-                elif check_overhangs(gene, OLS, overlapL, overlapR):
-                    DIMPLE.barcodeF.extend(compileF)  # return unused barcodes
-                    DIMPLE.barcodeR.extend(compileR)
-                    compileF = []  # reset unused primers
-                    compileR = []
-                    gene.genePrimer = (
-                        []
-                    )  # reset gene all primers due to nonspecific primer
-                    gene.barPrimer = []
-                    idx = 0
-                    continue  # return to the beginning
-                # Store
-                gene.genePrimer.append(
-                    SeqRecord(
-                        reverse,
-                        id=gene.geneid + "_geneP_Mut-" + str(idx + 1) + "_R",
-                        description="Frag"
-                        + fragstart
-                        + "-"
-                        + fragend
-                        + " "
-                        + str(tmR)
-                        + "C",
+            if DIMPLE.stream_oligos:
+                gene.oligos = outputs.enter_context(
+                    OligoStream(
+                        os.path.join(folder.replace("\\", ""), gene.geneid + "_DMS_Oligos.fasta"),
+                        allOligos,
                     )
                 )
-                gene.genePrimer.append(
-                    SeqRecord(
-                        forward,
-                        id=gene.geneid + "_geneP_Mut-" + str(idx + 1) + "_F",
-                        description="Frag"
+            else:
+                gene.oligos = []
+            gene.barPrimer = []
+            gene.genePrimer = list(plan.genePrimers)
+            # record every variant for analysis with NGS, reruns start a new file
+            with MutationManifest(
+                os.path.join(folder.replace("\\", ""), gene.geneid + "_mutations.csv"),
+                gene.geneid,
+            ) as manifest:
+                # storage for unused barcodes
+                compileF = []
+                compileR = []
+                all_grouped_oligos = []
+                uniquefrags = {}  # duplication and deletion variants of the gene by digest
+                # Loop through each fragment
+                for idx, frag in enumerate(plan.breaklist):
+                    grouped_oligos = []
+                    fragstart, fragend = fragment_range(frag)
+                    fragdescription = "Frag " + fragstart + "-" + fragend
+                    print(
+                        "Creating Fragment:"
+                        + gene.geneid
+                        + " --- Fragment #" + str(idx+1) + " AA:"
                         + fragstart
                         + "-"
                         + fragend
-                        + " "
-                        + str(tmF)
-                        + "C",
                     )
-                )
-                # Determine missing double mutations
-                beginning = int(
-                    (frag[0] - DIMPLE.primerBuffer - sR) / 3
-                )  # Region missing double mutations
-                if beginning < 1:
-                    beginning = 1
-                end = ceil((frag[1] - DIMPLE.primerBuffer + sF) / 3)
-                if end > ceil((gene.breaksites[-1] - DIMPLE.primerBuffer) / 3):
-                    end = ceil((gene.breaksites[-1] - DIMPLE.primerBuffer) / 3)
-                missingTmp = set()
-                for site in range(
-                    beginning, end
-                ):  # Record these missing double mutations
-                    for site2 in range(site + 1, end):
-                        missingSites.append([site, site2])
-                        missingTmp.add(site)
-                        missingTmp.add(site2)
-                        # missingTable[site][site2] = 0
-                missingFragments.append(
-                    [(frag[0] - 30) / 3, (frag[1] - 30) / 3, list(missingTmp)]
-                )
-            if gene.unique_Frag[idx]:  # only for unique sequences
-                # Create gene fragments with insertions
-                count = 0
-                tmpseq = gene.seq[
-                    frag[0] - DIMPLE.cutsite_overhang - overlapL : frag[1] + DIMPLE.cutsite_overhang + overlapR
-                ].replace(
-                    "-", ""
-                )  # extract sequence for oligo fragment include an extra 4 bases for BsmBI cut site and overlap
-                offset = DIMPLE.cutsite_overhang + overlapL
-                ## Create the mutations
-                dms_sequences = []
-                dms_sequences_double = []
-                # list positions to mutate
-                if custom_mutations:
-                    # find custom mutations in the fragment range
-                    tmp_positions = list(custom_mutations.keys())
-                    tmp_tmp_positions = [
-                        x * 3 - 3 + gene.primerBuffer
-                        for x in list(custom_mutations.keys())
-                    ]
-                    tmp_mut_positions = [
-                        [i, x + offset - frag[0]]
-                        for i, x in enumerate(tmp_tmp_positions)
-                        if frag[0] <= x + 3 <= frag[1] - 3
-                    ]
-                    mut_positions = [x for i, x in tmp_mut_positions]
-                    positions = [tmp_positions[i] for i, x in tmp_mut_positions]
-                else:
-                    mut_positions = range(offset, offset + frag[1] - frag[0], 3)
-                    positions = [int((frag[0] + x + 3 - offset - DIMPLE.primerBuffer) / 3) for x in mut_positions]
-                ### Deep Mutational Scanning
-                if dms:
-                    mutations = {}
-                    for i in mut_positions:
-                        wt_codon = tmpseq[i : i + 3].upper()
-                        wt = [
-                            name
-                            for name, codon in gene.SynonymousCodons.items()
-                            if wt_codon in codon
-                        ] 
+                    if gene.unique_Frag[idx]:  # only for unique sequences
+                        # Create gene fragments with insertions
+                        count = 0
+                        tmpseq = gene.seq[
+                            frag[0] - DIMPLE.cutsite_overhang - overlapL : frag[1] + DIMPLE.cutsite_overhang + overlapR
+                        ].replace(
+                            "-", ""
+                        )  # extract sequence for oligo fragment include an extra 4 bases for BsmBI cut site and overlap
+                        offset = DIMPLE.cutsite_overhang + overlapL
+                        siteChecker.set_fragment(tmpseq)
+                        if duplicate or delete:
+                            fragmentHash = EditHash(tmpseq)
+                            frameStops = FrameStops(
+                                tmpseq, offset, len(tmpseq) - (DIMPLE.cutsite_overhang + overlapR)
+                            )
+                        ## Create the mutations
+                        dms_sequences = []
+                        dms_sequences_double = []
+                        # list positions to mutate
                         if custom_mutations:
-                            mutations_to_make = [
-                                seq3(x)
-                                for x in custom_mutations[
-                                    positions[mut_positions.index(i)]
-                                ].split(",")
+                            # find custom mutations in the fragment range
+                            tmp_positions = list(custom_mutations.keys())
+                            tmp_tmp_positions = [
+                                x * 3 - 3 + gene.primerBuffer
+                                for x in list(custom_mutations.keys())
+                            ]
+                            tmp_mut_positions = [
+                                [i, x + offset - frag[0]]
+                                for i, x in enumerate(tmp_tmp_positions)
+                                if frag[0] <= x + 3 <= frag[1] - 3
                             ]
+                            mut_positions = [x for i, x in tmp_mut_positions]
+                            positions = [tmp_positions[i] for i, x in tmp_mut_positions]
                         else:
-                            mutations_to_make = gene.aminoacids
-                        for jk in (x for x in mutations_to_make): 
-                            # check if synonymous and if user wants these mutations
-                            if jk not in wt[0] or synonymous:
-                                codons = [
-                                    aa
-                                    for aa in gene.SynonymousCodons[jk]
-                                    if aa not in wt_codon
-                                ]
-                                p = [
-                                    gene.usage[aa] for aa in codons 
-                                ]  # Find probabilities but not wild type codon
-                                p = [
-                                    xp if xp > 0.1 else 0 for xp in p
-                                ]  # Remove probabilities below 0.1
-                                p = [xp / sum(p) for xp in p]  # Normalize to 1
-                                if not p:
-                                    continue
-                                # if the user wants to maximize the number of nucleotide changes
-                                synonymous_mutation = []
-                                synonymous_position = 0
-                                if DIMPLE.maximize_nucleotide_change:
-                                    # remove codons with only one change compared to wt_codon
-                                    max_codons = [x for x in codons if sum([x[i] != wt_codon[i] for i in range(3)]) > 1]
-                                    if max_codons:
-                                        # if there are codons with more than one base change
-                                        mutation = gene.rng.choice(
-                                            max_codons, 1, p
-                                        )  # Pick one codon
-                                        xfrag = (
-                                                tmpseq[0:i] + mutation[0] + tmpseq[i + 3:]
-                                        )  # Add mutation to fragment
-                                    else:
+                            mut_positions = range(offset, offset + frag[1] - frag[0], 3)
+                            positions = [int((frag[0] + x + 3 - offset - DIMPLE.primerBuffer) / 3) for x in mut_positions]
+                        ### Deep Mutational Scanning
+                        if dms:
+                            mutations = {}
+                            substituted = {}  # offset and codon of each substitution
+                            codonModel = gene.codon_model()
+                            # list the substitutions of every position to pick all codons at once
+                            substitutions = []
+                            for i in mut_positions:
+                                wt_codon = str(tmpseq[i : i + 3].upper())
+                                wt = codonModel.aa[wt_codon]
+                                if custom_mutations:
+                                    mutations_to_make = [
+                                        seq3(x)
+                                        for x in custom_mutations[
+                                            positions[mut_positions.index(i)]
+                                        ].split(",")
+                                    ]
+                                else:
+                                    mutations_to_make = gene.aminoacids
+                                todo = []
+                                for jk in mutations_to_make:
+                                    # check if synonymous and if user wants these mutations
+                                    if jk not in wt or synonymous:
+                                        if not codonModel.candidates(wt_codon, jk)[0]:
+                                            continue
+                                        # if the user wants to maximize the number of nucleotide changes
+                                        # use codons with more than one base change if there are any
+                                        if DIMPLE.maximize_nucleotide_change and codonModel.candidates(wt_codon, jk, 2)[0]:
+                                            todo.append((jk, (wt_codon, jk, 2)))
+                                        else:
+                                            todo.append((jk, (wt_codon, jk, 1)))
+                                substitutions.append((i, wt, todo))
+                            picked = iter(
+                                codonModel.sample(
+                                    [key for i, wt, todo in substitutions for jk, key in todo], gene.rng
+                                )
+                            )
+                            for i, wt, todo in substitutions:
+                                for jk, key in todo:
+                                    wt_codon = key[0]
+                                    mutation = next(picked)
+                                    synonymous_mutation = []
+                                    synonymous_position = 0
+                                    name = (
+                                        ">"
+                                        + wt
+                                        + str(
+                                            int(
+                                                (frag[0] + i + 6 - offset - DIMPLE.primerBuffer)
+                                                / 3
+                                            )
+                                        )
+                                        + jk
+                                    )
+                                    # edited bases of the fragment as (offset, deleted, inserted)
+                                    if DIMPLE.maximize_nucleotide_change and key[2] == 1:
                                         # no codons with more than one base change. Creating synonymous mutation in neighboring codon.
-                                        mutation = gene.rng.choice(
-                                            codons, 1, p
-                                        )  # Pick one codon
-                                        # find neighboring codon
-                                        tmp_synonymous = [name for name, codon in gene.SynonymousCodons.items() if tmpseq[i-3:i] in codon]
-                                        synonymous_codons = gene.SynonymousCodons[tmp_synonymous[0]]
-                                        max_synonymous = [x for x in synonymous_codons if sum([x[c] != tmpseq[i-3:i][c] for c in range(3)]) > 0]
+                                        neighbor = str(tmpseq[i-3:i]).upper()
+                                        max_synonymous = codonModel.candidates(neighbor, codonModel.aa[neighbor])[0]
                                         if max_synonymous and not (idx == 0 and mut_positions.index(i) == 0):
                                             synonymous_mutation = gene.rng.choice(max_synonymous, 1)
-                                            xfrag = (
-                                                    tmpseq[0:i-3] + synonymous_mutation[0] + mutation[0] + tmpseq[i + 3:]
-                                            )  # Add mutation to fragment
+                                            edit = (i - 3, 6, synonymous_mutation[0] + mutation)  # Add mutation to fragment
                                             synonymous_position = -1
                                         else:
-                                            tmp_synonymous = [name for name, codon in gene.SynonymousCodons.items() if tmpseq[i+3:i+6] in codon]
-                                            synonymous_codons = gene.SynonymousCodons[tmp_synonymous[0]]
-                                            max_synonymous = [x for x in synonymous_codons if
-                                                              sum([x[c] != tmpseq[i+3:i+6][c] for c in range(3)]) > 0]
+                                            neighbor = str(tmpseq[i+3:i+6]).upper()
+                                            max_synonymous = codonModel.candidates(neighbor, codonModel.aa[neighbor])[0]
                                             if max_synonymous:
                                                 synonymous_mutation = gene.rng.choice(
                                                     max_synonymous, 1
                                                 )
-                                                xfrag = (
-                                                        tmpseq[0:i] + mutation[0] + synonymous_mutation[0] + tmpseq[i+6:]
-                                                )  # Add mutation to fragment
+                                                edit = (i, 6, mutation + synonymous_mutation[0])  # Add mutation to fragment
                                                 synonymous_position = +1
                                             else:
                                                 print('Unable to create synonymous mutation in neighboring codon. Continuing with single nucleotide change')
-                                                xfrag = (tmpseq[0:i] + mutation[0] + tmpseq[i + 3:])
-                                                print(xfrag)
-                                else:
-                                    mutation = gene.rng.choice(
-                                        codons, 1, p
-                                    )  # Pick one codon
-                                    xfrag = (
-                                            tmpseq[0:i] + mutation[0] + tmpseq[i + 3:]
-                                    )  # Add mutation to fragment
-                                # Check each cassette for more than 2 BsmBI and 2 BsaI sites
-                                avoid_count = 0
-                                while any(
-                                    [
-                                        (
-                                            xfrag.upper().count(x)
-                                            + xfrag.upper().count(
-                                                x.reverse_complement()
-                                            )
-                                        )
-                                        > 0
-                                        for x in DIMPLE.avoid_sequence
-                                    ]
-                                ):
-                                    mutation = gene.rng.choice(
-                                        gene.SynonymousCodons[jk], 1, p
-                                    )  # Pick one codon
-                                    avoid_count += 1
-                                    xfrag = tmpseq[0:i] + mutation[0] + tmpseq[i + 3 :]
-                                    if avoid_count > 10:
-                                        warnings.warn(
-                                            "Unwanted restriction site found within fragment: " + str(xfrag)
-                                        )
-                                        break
-                                mutations[
-                                    ">"
-                                    + wt[0]
-                                    + str(
-                                        int(
-                                            (frag[0] + i + 6 - offset - DIMPLE.primerBuffer)
-                                            / 3
-                                        )
-                                    )
-                                    + jk
-                                    ] = mutation[0]
-                                # if there was a synonymous mutation added then add the synonymous mutation to the mutation list
-                                if synonymous_mutation:
-                                    mutations[
-                                        ">"
-                                        + wt[0]
-                                        + str(
-                                            int(
-                                                (frag[0] + i + 6 - offset - DIMPLE.primerBuffer)
-                                                / 3
+                                                edit = (i, 3, mutation)
+                                                print(tmpseq[0:i] + mutation + tmpseq[i + 3:])
+                                    else:
+                                        edit = (i, 3, mutation)  # Add mutation to fragment
+                                    xfrag = Variant(tmpseq, *edit, gene.geneid, "DMS", idx + 1, name[1:], fragdescription)
+                                    # Check each cassette for more than 2 BsmBI and 2 BsaI sites
+                                    avoid_count = 0
+                                    while siteChecker.found_variant(xfrag):
+                                        mutation = codonModel.sample(
+                                            [(wt_codon, jk, 0)], gene.rng
+                                        )[0]  # Pick one codon
+                                        avoid_count += 1
+                                        xfrag = Variant(tmpseq, i, 3, mutation, gene.geneid, "DMS", idx + 1, name[1:], fragdescription)
+                                        if avoid_count > 10:
+                                            warnings.warn(
+                                                "Unwanted restriction site found within fragment: " + str(xfrag.seq)
                                             )
-                                        )
-                                        + jk
-                                        ] += str(synonymous_position) + '_' + synonymous_mutation[0]
-                                dms_sequences.append(
+                                            break
+                                    mutations[name] = mutation
+                                    substituted[name] = (i, mutation)
+                                    # if there was a synonymous mutation added then add the synonymous mutation to the mutation list
+                                    if synonymous_mutation:
+                                        mutations[name] += str(synonymous_position) + '_' + synonymous_mutation[0]
+                                    dms_sequences.append(xfrag)
+                            # if double mutations are selected then make every possible double mutation
+                            if DIMPLE.make_double:
+                                # double mutants are only made while they are written
+                                dms_sequences_double = (
                                     SeqRecord(
                                         xfrag,
                                         id=gene.geneid
-                                        + "_DMS-"
-                                        + str(idx + 1)
-                                        + "_"
-                                        + wt[0]
+                                           + "_DMS-"
+                                           + str(idx + 1)
+                                           + "_"
+                                           + first.strip(">")
+                                           + "+"
+                                           + second.strip(">"),
+                                        description="Frag " + fragstart + "-" + fragend
+                                    )
+                                    for first, second, xfrag in double_mutants(
+                                        tmpseq, substituted, DIMPLE.double_count, DIMPLE.double_window, gene.rng
+                                    )
+                                )
+                            # record mutation for analysis with NGS
+                            for mut in mutations.keys():
+                                manifest.write(mut, mutations[mut])
+                
+                        # fix the bug where dimple doesn't insert after the last codon in the gene
+                        if idx == len(plan.breaklist) - 1:
+                            final_codon_extension = 3
+                        else:
+                            final_codon_extension = 0
+                        ### Scanning Insertions
+                        # add phase-shifting to insertions?
+                        if insert:
+                            for i in range(offset, offset + frag[1] - frag[0] + final_codon_extension, 3):
+                                for insert_n in insert:
+                                    xfrag = Variant(
+                                        tmpseq,
+                                        i,
+                                        0,
+                                        insert_n,  # Add mutation to fragment
+                                        gene.geneid,
+                                        "insert",
+                                        idx + 1,
+                                        insert_n
+                                        + "-"
                                         + str(
                                             int(
                                                 (
                                                     frag[0]
                                                     + i
-                                                    + 6
+                                                    + 3
                                                     - offset
                                                     - DIMPLE.primerBuffer
                                                 )
                                                 / 3
                                             )
-                                        )
-                                        + jk,
-                                        description="Frag " + fragstart + "-" + fragend,
+                                        ),
+                                        fragdescription,
                                     )
-                                )
-                        # if double mutations are selected then make every possible double mutation
-                        if DIMPLE.make_double:
-                            # select every permutation of mut_positions order doesn't matter
-                            for combi in itertools.combinations(mutations.keys(), 2):
-                                # extract number from mutation name
-                                if "STOP" not in combi[0] and "STOP" not in combi[1]:
-                                    pos1 = mut_positions[
-                                        positions.index(int(re.findall(r'\d+', combi[0])[0]))
-                                    ]
-                                    pos2 = mut_positions[
-                                        positions.index(int(re.findall(r'\d+', combi[1])[0]))
-                                    ]
-                                    if pos1 != pos2:
-                                        xfrag = (
-                                                tmpseq[0:pos1]
-                                                + mutations[combi[0]]
-                                                + tmpseq[pos1 + 3: pos2]
-                                                + mutations[combi[1]]
-                                                + tmpseq[pos2 + 3:]
-                                        )
-                                        dms_sequences_double.append(
-                                            SeqRecord(
-                                                xfrag,
-                                                id=gene.geneid
-                                                   + "_DMS-"
-                                                   + str(idx + 1)
-                                                   + "_"
-                                                   + combi[0].strip(">")
-                                                   + "+"
-                                                   + combi[1].strip(">"),
-                                                description="Frag " + fragstart + "-" + fragend
-                                            )
-                                        )
-                    # record mutation for analysis with NGS
-                    with open(
-                        os.path.join(
-                            folder.replace("\\", ""), gene.geneid + "_mutations.csv"
-                        ),
-                        "a",
-                    ) as file:
-                        for mut in mutations.keys():
-                            file.write(mut + "\n")
-                            file.write(mutations[mut] + "\n")
-                
-                # fix the bug where dimple doesn't insert after the last codon in the gene
-                if idx == len(gene.breaklist) - 1:
-                    final_codon_extension = 3
-                else:
-                    final_codon_extension = 0
-                ### Scanning Insertions
-                # add phase-shifting to insertions?
-                if insert:
-                    for i in range(offset, offset + frag[1] - frag[0] + final_codon_extension, 3):
-                        for insert_n in insert:
-                            xfrag = (
-                                tmpseq[0:i] + insert_n + tmpseq[i:]
-                            )  # Add mutation to fragment
-                            # Check each cassette for more than 2 BsmBI and 2 BsaI sites
-                            while any(
-                                [
-                                    (
-                                        xfrag.upper().count(x)
-                                        + xfrag.upper().count(x.reverse_complement())
-                                    )
-                                    > 0
-                                    for x in DIMPLE.avoid_sequence
-                                ]
-                            ):
-                                warnings.warn(
-                                    "Unwanted restriction site found within insertion fragment: " + str(xfrag)
-                                )
-                                break
-                                # not sure how to solve this issue
-                                # mutation?
-                                # xfrag = tmpseq[0:i] + mutation + tmpseq[i + 3:]
-                            dms_sequences.append(
-                                SeqRecord(
-                                    xfrag,
-                                    id=gene.geneid
-                                    + "_insert-"
-                                    + str(idx + 1)
-                                    + "_"
-                                    + insert_n
-                                    + "-"
-                                    + str(
-                                        int(
-                                            (
-                                                frag[0]
-                                                + i
-                                                + 3
-                                                - offset
-                                                - DIMPLE.primerBuffer
-                                            )
-                                            / 3
+                                    # Check each cassette for more than 2 BsmBI and 2 BsaI sites
+                                    if siteChecker.found_variant(xfrag):
+                                        warnings.warn(
+                                            "Unwanted restriction site found within insertion fragment: " + str(xfrag.seq)
                                         )
-                                    ),
-                                    description="Frag " + fragstart + "-" + fragend,
-                                )
-                            )
-                ### Scanning Phase-variable duplications
-                if duplicate:
-                    for phase in gene.phase:
-                        for i in range(offset, offset + frag[1] - frag[0] + final_codon_extension, 3):
-                            gene_i = frag[0] + i - offset - 3 # codon index in full gene
-                            dup_start = gene_i + phase
-                            print(frag[0], frag[1])
-                            for duplicate_n in duplicate:
-                                if dup_start + duplicate_n <= gene.end: # dont duplicate past the last codon of the gene
-                                    # want to slice duplication from original coding sequence to avoid going out of range at end of fragment
-                                    duplication = gene.seq[dup_start : dup_start + duplicate_n].replace("-", "")
-                                    if len(duplication) % 3 == 0: # don't add frameshift, which won't happen if user enters duplicate argument as multiples of 3
-                                        insert_site = i + phase + duplicate_n - 3
-                                        xfrag = tmpseq[0: insert_site] + duplication + tmpseq[insert_site: ]
-                                        xfrag_cds = xfrag[DIMPLE.cutsite_overhang + overlapL : -(DIMPLE.cutsite_overhang + overlapR)]
-                                        premature_stop = xfrag_cds.translate().count("*")
-                                        if xfrag not in uniquefrag_set and not premature_stop: # Avoid adding redundant sequences and premature stops
-                                            uniquefrag_set.add(xfrag)
-                                            if DIMPLE.maximize_nucleotide_change and duplicate_n > 3: # recode long duplicates with synonymous mutations -- easier to synthesize
-                                                recode_start, recode_end = 0, len(duplication)
-                                                if phase != 0:
-                                                    recode_start, recode_end = 3 - phase, -phase
-                                                dup_slice = str(duplication[recode_start: recode_end])
-                                                # Synonymously mutate every codon of the duplication, maximizing the number of nucleotide changes
-                                                old_cds = split_to_codons(dup_slice)
-                                                recode_dup_slice = ""
-                                                for old_codon in old_cds:
-                                                    old_codon = old_codon.upper()
-                                                    old_aa = [aa for aa, codons in gene.SynonymousCodons.items() if old_codon in codons][0]
-                                                    syn_codons = gene.SynonymousCodons[old_aa]                                                       
-                                                    change_3 = [cod for cod in syn_codons if (sum([old_codon[i] != cod[i] for i in range(3)]) == 3)]
-                                                    change_2 = [cod for cod in syn_codons if (sum([old_codon[i] != cod[i] for i in range(3)]) == 2)]
-                                                    change_1 = [cod for cod in syn_codons if (sum([old_codon[i] != cod[i] for i in range(3)]) == 1)]
-                                                    if change_3:
-                                                        p = [gene.usage[codon] for codon in change_3]
-                                                        #p = [xp if xp > 0.1 else 0 for xp in p]
-                                                        p = [xp/sum(p) for xp in p]
-                                                        recode_dup_slice += gene.rng.choice(change_3, 1, p)[0]
-                                                    elif change_2:
-                                                        p = [gene.usage[codon] for codon in change_2]
-                                                        #p = [xp if xp > 0.1 else 0 for xp in p]
-                                                        p = [xp/sum(p) for xp in p]
-                                                        recode_dup_slice += gene.rng.choice(change_2, 1, p)[0]
-                                                    elif change_1:
-                                                        p = [gene.usage[codon] for codon in change_1]
-                                                        #p = [xp if xp > 0.1 else 0 for xp in p]
-                                                        p = [xp/sum(p) for xp in p]
-                                                        recode_dup_slice += gene.rng.choice(change_1, 1, p)[0]
+                                        # not sure how to solve this issue
+                                        # mutation?
+                                        # xfrag = tmpseq[0:i] + mutation + tmpseq[i + 3:]
+                                    dms_sequences.append(xfrag)
+                                    manifest.add_variant(xfrag, insert_n)
+                        ### Scanning Phase-variable duplications
+                        if duplicate:
+                            for phase in gene.phase:
+                                for i in range(offset, offset + frag[1] - frag[0] + final_codon_extension, 3):
+                                    gene_i = frag[0] + i - offset - 3 # codon index in full gene
+                                    dup_start = gene_i + phase
+                                    print(frag[0], frag[1])
+                                    for duplicate_n in duplicate:
+                                        if dup_start + duplicate_n <= gene.end: # dont duplicate past the last codon of the gene
+                                            # want to slice duplication from original coding sequence to avoid going out of range at end of fragment
+                                            duplication = gene.seq[dup_start : dup_start + duplicate_n].replace("-", "")
+                                            if len(duplication) % 3 == 0: # don't add frameshift, which won't happen if user enters duplicate argument as multiples of 3
+                                                insert_site = i + phase + duplicate_n - 3
+                                                premature_stop = frameStops.count(insert_site, 0, duplication)
+                                                digest = fragmentHash.digest(insert_site, insert_site, duplication)
+                                                if digest not in uniquefrags and not premature_stop: # Avoid adding redundant sequences and premature stops
+                                                    if DIMPLE.maximize_nucleotide_change and duplicate_n > 3: # recode long duplicates with synonymous mutations -- easier to synthesize
+                                                        recode_start, recode_end = 0, len(duplication)
+                                                        if phase != 0:
+                                                            recode_start, recode_end = 3 - phase, -phase
+                                                        dup_slice = str(duplication[recode_start: recode_end])
+                                                        # Synonymously mutate every codon of the duplication, maximizing the number of nucleotide changes
+                                                        codonModel = gene.codon_model(cutoff=0)  # rare codons are not excluded here
+                                                        old_cds = [codon.upper() for codon in split_to_codons(dup_slice)]
+                                                        keys = []
+                                                        for old_codon in old_cds:
+                                                            old_aa = codonModel.aa[old_codon]
+                                                            keys.append(None)  # could not recode (Met or Trp)
+                                                            for min_change in (3, 2, 1):
+                                                                if codonModel.candidates(old_codon, old_aa, min_change)[0]:
+                                                                    keys[-1] = (old_codon, old_aa, min_change)
+                                                                    break
+                                                        picked = iter(codonModel.sample([key for key in keys if key], gene.rng))
+                                                        recode_dup_slice = "".join(
+                                                            next(picked) if key else old_codon for old_codon, key in zip(old_cds, keys)
+                                                        )
+                                                        recode_dup = duplication[0:recode_start] + recode_dup_slice + duplication[recode_end:len(duplication)]
+                                                        recode_dup_name = ">" + str(recode_dup)
                                                     else:
-                                                        recode_dup_slice += old_codon # could not recode (Met or Trp)
-                                                recode_dup = duplication[0:recode_start] + recode_dup_slice + duplication[recode_end:len(duplication)]
-                                                xfrag = tmpseq[0: insert_site] + recode_dup + tmpseq[insert_site: ]
-                                                recode_dup_name = ">" + str(recode_dup)
-                                            else:
-                                                recode_dup_name = ""
-                                            # Check each cassette for more than 2 BsmBI and 2 BsaI sites
-                                            while any(
-                                                [
-                                                    (
-                                                        xfrag.upper().count(x)
-                                                        + xfrag.upper().count(x.reverse_complement())
-                                                    )
-                                                    > 0
-                                                    for x in DIMPLE.avoid_sequence
-                                                ]
-                                            ):
-                                                warnings.warn(
-                                                    "Unwanted restriction site found within insertion fragment: " + str(xfrag)
-                                                )
-                                                break # can fix by recoding codons
-                                            dms_sequences.append(
-                                                SeqRecord(
-                                                    xfrag,
-                                                    id=gene.geneid
-                                                    + "_dup-"
-                                                    + str(idx + 1) # index of sublibrary 
-                                                    + "_"
-                                                    + str(duplication)
-                                                    + recode_dup_name
-                                                    + "-"
-                                                    + str(
-                                                        int(
-                                                            (
-                                                                frag[0]
-                                                                + i
-                                                                + 3
-                                                                - offset
-                                                                - DIMPLE.primerBuffer
+                                                        recode_dup = duplication
+                                                        recode_dup_name = ""
+                                                    variant = Variant(
+                                                        tmpseq,
+                                                        insert_site,
+                                                        0,
+                                                        recode_dup,
+                                                        gene.geneid,
+                                                        "dup",
+                                                        idx + 1,  # index of sublibrary
+                                                        str(duplication)
+                                                        + recode_dup_name
+                                                        + "-"
+                                                        + str(
+                                                            int(
+                                                                (
+                                                                    frag[0]
+                                                                    + i
+                                                                    + 3
+                                                                    - offset
+                                                                    - DIMPLE.primerBuffer
+                                                                )
+                                                                / 3 # amino acid position
                                                             )
-                                                            / 3 # amino acid position
                                                         )
+                                                        + "+"
+                                                        + str(phase), # final name format: Kir_dup-1_GACATG>GATATG-33+0
+                                                        fragdescription,
                                                     )
-                                                    + "+"
-                                                    + str(phase), # final name format: Kir_dup-1_GACATG>GATATG-33+0
-                                                    description="Frag " + fragstart + "-" + fragend,
-                                                )
-                                            )
-                                        else:
-                                            if premature_stop:
-                                                stop = "STOP"
-                                            else:
-                                                stop = ""
-                                            gene.redundantSeq.append(
-                                                SeqRecord(
-                                                    xfrag,
-                                                    id=gene.geneid
-                                                    + "_dup-"
-                                                    + str(idx + 1)
-                                                    + "_"
-                                                    + str(duplication)
-                                                    + "-"
-                                                    + str(
-                                                        int(
-                                                            (
-                                                                frag[0]
-                                                                + i
-                                                                + 3
-                                                                - offset
-                                                                - DIMPLE.primerBuffer
+                                                    # Check each cassette for more than 2 BsmBI and 2 BsaI sites
+                                                    if siteChecker.found_variant(variant):
+                                                        warnings.warn(
+                                                            "Unwanted restriction site found within insertion fragment: " + str(variant.seq)
+                                                        )  # can fix by recoding codons
+                                                    uniquefrags[digest] = variant
+                                                    dms_sequences.append(variant)
+                                                    manifest.add_variant(variant, recode_dup)
+                                                else:
+                                                    if premature_stop:
+                                                        stop = "STOP"
+                                                    else:
+                                                        stop = ""
+                                                    gene.add_redundant(
+                                                        Variant(
+                                                            tmpseq,
+                                                            insert_site,
+                                                            0,
+                                                            duplication,
+                                                            gene.geneid,
+                                                            "dup",
+                                                            idx + 1,
+                                                            str(duplication)
+                                                            + "-"
+                                                            + str(
+                                                                int(
+                                                                    (
+                                                                        frag[0]
+                                                                        + i
+                                                                        + 3
+                                                                        - offset
+                                                                        - DIMPLE.primerBuffer
+                                                                    )
+                                                                    / 3 
+                                                                )
                                                             )
-                                                            / 3 
-                                                        )
+                                                            + "+"
+                                                            + str(phase)
+                                                            + stop,
+                                                            fragdescription,
+                                                        ),
+                                                        None if premature_stop else uniquefrags[digest],
                                                     )
-                                                    + "+"
-                                                    + str(phase)
-                                                    + stop,
-                                                    description="Frag " + fragstart + "-" + fragend,
-                                                )
-                                            )
-                ### Scanning Phase-variable Deletions
-                if delete:
-                    for phase in gene.phase:
-                        for i in range(offset, offset + frag[1] - frag[0], 3):
-                            for delete_n in delete:
-                                if delete_n + i + phase > len(tmpseq):
-                                    print("overlap: ", overlapL)
-                                    print("offset: ", offset)
-                                    print("frag: ", frag)
-                                    print("tmpseq: ", tmpseq)
-                                    print("delete_n: ", delete_n)
-                                    print("length: ", len(tmpseq))
-                                    print("max i: ", offset + frag[1] - frag[0] + 3)
-                                    print("i: ", i)
-                                    print("phase-shift: +", phase)
-                                    raise ValueError(
-                                        "deletions cannot be larger than fragment itself: increase overlap length."
-                                    )
-                                else:
-                                    xfrag = (
-                                        tmpseq[0:i + phase] + tmpseq[i + phase + delete_n:]
-                                    )  # delete forward from position only
-                                    xfrag_cds = xfrag[DIMPLE.cutsite_overhang + overlapL : -(DIMPLE.cutsite_overhang + overlapR)]
-                                    premature_stop = xfrag_cds.translate().count("*")
-                                    if xfrag not in uniquefrag_set and not premature_stop: # Avoid adding redundant sequences and premature stops
-                                        uniquefrag_set.add(xfrag)
-                                        # Check each cassette for more than 2 BsmBI and 2 BsaI sites
-                                        while any(
-                                            [
-                                                (
-                                                    xfrag.upper().count(x)
-                                                    + xfrag.upper().count(x.reverse_complement())
-                                                )
-                                                > 0
-                                                for x in DIMPLE.avoid_sequence
-                                            ]
-                                        ):
-                                            warnings.warn(
-                                                "Unwanted restriction site found within insertion fragment: " + str(xfrag)
+                        ### Scanning Phase-variable Deletions
+                        if delete:
+                            for phase in gene.phase:
+                                for i in range(offset, offset + frag[1] - frag[0], 3):
+                                    for delete_n in delete:
+                                        if delete_n + i + phase > len(tmpseq):
+                                            print("overlap: ", overlapL)
+                                            print("offset: ", offset)
+                                            print("frag: ", frag)
+                                            print("tmpseq: ", tmpseq)
+                                            print("delete_n: ", delete_n)
+                                            print("length: ", len(tmpseq))
+                                            print("max i: ", offset + frag[1] - frag[0] + 3)
+                                            print("i: ", i)
+                                            print("phase-shift: +", phase)
+                                            raise ValueError(
+                                                "deletions cannot be larger than fragment itself: increase overlap length."
                                             )
-                                            break
-                                            # xfrag = tmpseq[0:i-delete_n-3] + tmpseq[i+delete_n:] iteratively shift deletion to avoid cut sites? or mutate codons of near by aa?
-                                        dms_sequences.append(
-                                            SeqRecord(
-                                                xfrag,
-                                                id=gene.geneid
-                                                + "_delete-"
-                                                + str(idx + 1)
-                                                + "_"
-                                                + str(delete_n)
+                                        else:
+                                            variant = Variant(
+                                                tmpseq,
+                                                i + phase,
+                                                delete_n,
+                                                "",  # delete forward from position only
+                                                gene.geneid,
+                                                "delete",
+                                                idx + 1,
+                                                str(delete_n)
                                                 + "-"
                                                 + str(
                                                     int(
@@ -1563,350 +2097,345 @@ def generate_DMS_fragments(
                                                 )
                                                 + "+"
                                                 + str(phase),
-                                                description="Frag " + fragstart + "-" + fragend,
+                                                fragdescription,
                                             )
-                                        )
-                                    else:
-                                        gene.redundantSeq.append(
-                                            SeqRecord(
-                                                xfrag,
-                                                id=gene.geneid
-                                                + "_delete-"
-                                                + str(idx + 1)
-                                                + "_"
-                                                + str(delete_n)
-                                                + "-"
-                                                + str(
-                                                    int(
-                                                        (
-                                                            frag[0]
-                                                            + i
-                                                            + 6
-                                                            - offset
-                                                            - DIMPLE.primerBuffer
-                                                        )
-                                                        / 3
+                                            premature_stop = frameStops.count(i + phase, delete_n)
+                                            digest = fragmentHash.digest(i + phase, i + phase + delete_n)
+                                            if digest not in uniquefrags and not premature_stop: # Avoid adding redundant sequences and premature stops
+                                                uniquefrags[digest] = variant
+                                                # Check each cassette for more than 2 BsmBI and 2 BsaI sites
+                                                if siteChecker.found_variant(variant):
+                                                    warnings.warn(
+                                                        "Unwanted restriction site found within insertion fragment: " + str(variant.seq)
                                                     )
+                                                    # xfrag = tmpseq[0:i-delete_n-3] + tmpseq[i+delete_n:] iteratively shift deletion to avoid cut sites? or mutate codons of near by aa?
+                                                dms_sequences.append(variant)
+                                                manifest.add_variant(
+                                                    variant, tmpseq[i + phase: i + phase + delete_n]
                                                 )
-                                                + "+"
-                                                + str(phase),
-                                                description="Frag " + fragstart + "-" + fragend,
-                                            )
+                                            else:
+                                                gene.add_redundant(variant, None if premature_stop else uniquefrags[digest])
+                        ### Scanning Domain Insertions
+                        if dis:
+                            # insertion
+                            for i in range(offset, offset + frag[1] - frag[0], 3):
+                                # if idx == 0:
+                                #    continue
+                                xfrag = Variant(
+                                    tmpseq,
+                                    i,
+                                    0,
+                                    DIMPLE.handle,  # Add mutation to fragment
+                                    gene.geneid,
+                                    "DIS",
+                                    idx + 1,
+                                    str(
+                                        int(
+                                            (frag[0] + i + 3 - offset - DIMPLE.primerBuffer) / 3
                                         )
-                ### Scanning Domain Insertions
-                if dis:
-                    # insertion
-                    for i in range(offset, offset + frag[1] - frag[0], 3):
-                        # if idx == 0:
-                        #    continue
-                        xfrag = (
-                                tmpseq[0:i] + DIMPLE.handle + tmpseq[i:]
-                        )  # Add mutation to fragment
-                        # Check each cassette for more than 2 BsmBI and 2 BsaI sites
-                        while any(
-                                [
-                                    (
-                                            xfrag.upper().count(x)
-                                            + xfrag.upper().count(x.reverse_complement())
+                                    ),
+                                    fragdescription,
+                                )
+                                # Check each cassette for more than 2 BsmBI and 2 BsaI sites
+                                if siteChecker.found_variant(xfrag, 2):
+                                    warnings.warn(
+                                        "Unwanted restriction site found within insertion fragment: " + str(xfrag.seq)
                                     )
-                                    > 2
-                                    for x in DIMPLE.avoid_sequence
-                                ]
+                                    # not sure how to solve this issue
+                                    # mutation?
+                                    # xfrag = tmpseq[0:i] + mutation + tmpseq[i + 3:]
+                                dms_sequences.append(xfrag)
+                                manifest.add_variant(xfrag, DIMPLE.handle)
+                        for idx_type, dms_sequence_list in enumerate(
+                                [dms_sequences, dms_sequences_double]
                         ):
-                            warnings.warn(
-                                "Unwanted restriction site found within insertion fragment: " + str(xfrag)
-                            )
-                            # not sure how to solve this issue
-                            # mutation?
-                            # xfrag = tmpseq[0:i] + mutation + tmpseq[i + 3:]
-                        dms_sequences.append(
-                            SeqRecord(
-                                xfrag,
-                                id=gene.geneid
-                                   + "_DIS-"
-                                   + str(idx + 1)
-                                   + "_"
-                                   + str(
-                                    int(
-                                        (frag[0] + i + 3 - offset - DIMPLE.primerBuffer) / 3
-                                    )
-                                ),
-                                description="Frag " + fragstart + "-" + fragend,
-                            )
-                        )
-                for idx_type, dms_sequence_list in enumerate(
-                        [dms_sequences, dms_sequences_double]
-                ):
-                    if dms_sequence_list:  # are there any sequences to write?
-                        tmF = 0
-                        tmR = 0
-                        if gene.num_frag_per_oligo > 1:
-                            dms_sequence_list = combine_fragments(
-                                dms_sequence_list, gene.num_frag_per_oligo, gene.split
-                            )
-                        len_cutsite = len(DIMPLE.cutsite) + len(DIMPLE.cutsite_buffer) + DIMPLE.cutsite_overhang
-                        # determine barcodes for subpool amplification based on smallest size
-                        frag_sizes = [len(xf.seq) for xf in dms_sequence_list]
-                        smallest_frag = dms_sequence_list[
-                            frag_sizes.index(min(frag_sizes))
-                        ].seq
-                        while (
-                                tmF < DIMPLE.primerTm[0] or tmR < DIMPLE.primerTm[0]
-                        ):  # swap out barcode if tm is low
-                            difference = DIMPLE.synth_len - (
-                                    len(smallest_frag) + len_cutsite*2
-                            )  # 14 bases is the length of the restriction sites with overhangs (7 bases each)
-                            barF = DIMPLE.barcodeF.pop(0)
-                            barR = DIMPLE.barcodeR.pop(0)
-                            count += 1  # How many barcodes used
-                            compileF.append(barF)
-                            compileR.append(barR)
-                            while difference / 2 > len(barF):
-                                tmpF = DIMPLE.barcodeF.pop(0)
-                                tmpR = DIMPLE.barcodeR.pop(0)
-                                compileF.append(tmpF)
-                                compileR.append(tmpR)
-                                barF += tmpF
-                                barR += tmpR
-                                count += 1  # How many barcodes used
-                            tmpfrag_1 = (
-                                    barF.seq[0: int(difference / 2)]
-                                    + DIMPLE.cutsite
-                                    + DIMPLE.cutsite_buffer
-                                    + tmpseq[0:DIMPLE.cutsite_overhang]
-                            )  # include recognition site and the 4 base overhang
-                            tmpfrag_2 = (
-                                    tmpseq[-DIMPLE.cutsite_overhang:]
-                                    + DIMPLE.cutsite_buffer.reverse_complement()
-                                    + DIMPLE.cutsite.reverse_complement()
-                                    + barR.seq.reverse_complement()[
-                                      0: difference - int(difference / 2)
-                                      ]
-                            )
-                            # primers for amplifying subpools
-                            offset = (
-                                    int(difference / 2) + len_cutsite
-                            )  # add 11 bases for type 2 restriction
-                            primerF, tmF = find_fragment_primer(tmpfrag_1, 25)
-                            if len(primerF) > 21:
+                            # double mutants are generated, look at the first one
+                            dms_sequence_list = iter(dms_sequence_list)
+                            first_sequence = next(dms_sequence_list, None)
+                            if first_sequence is not None:  # are there any sequences to write?
+                                dms_sequence_list = itertools.chain([first_sequence], dms_sequence_list)
                                 tmF = 0
-                            primerR, tmR = find_fragment_primer(
-                                tmpfrag_2.reverse_complement(), 25
-                            )
-                            if len(primerR) > 21:
                                 tmR = 0
-                        group_oligos = []
-                        for (
-                                sequence
-                        ) in (
-                                dms_sequence_list
-                        ):  # add barcodes to the fragments to make the oligos
-                            if insert or delete or duplicate:
-                                difference = (
-                                        DIMPLE.synth_len - len(sequence.seq[DIMPLE.cutsite_overhang:-DIMPLE.cutsite_overhang]) - len_cutsite*2
-                                )  # how many bases need to be added to make oligo correct length
-                                offset = int(difference / 2)  # force it to be a integer
-                                combined_sequence = (
-                                        tmpfrag_1[:offset]
-                                        + tmpfrag_1[-len_cutsite:]
-                                        + sequence.seq[DIMPLE.cutsite_overhang:-DIMPLE.cutsite_overhang]
-                                        + tmpfrag_2[:len_cutsite]
-                                        + tmpfrag_2[-(difference - offset):]
-                                )
-                            else:
-                                combined_sequence = (
-                                        tmpfrag_1 + sequence.seq[DIMPLE.cutsite_overhang:-DIMPLE.cutsite_overhang] + tmpfrag_2
-                                )
-                            if (
-                                    primerF not in combined_sequence
-                                    or primerR.reverse_complement() not in combined_sequence
-                            ):
-                                print(primerF)
-                                print(combined_sequence)
-                                print("---")
-                                print(combined_sequence.reverse_complement())
-                                print(primerR)
-                                raise Exception("primers no longer bind to oligo")
-                            if (
-                                    combined_sequence.upper().count(DIMPLE.cutsite)
-                                    + combined_sequence.upper().count(
-                                    DIMPLE.cutsite.reverse_complement()
+                                if idx_type == 0 or gene.num_frag_per_oligo > 1:
+                                    dms_sequence_list = list(dms_sequence_list)
+                                if gene.num_frag_per_oligo > 1:
+                                    dms_sequence_list = combine_fragments(
+                                        dms_sequence_list, gene.num_frag_per_oligo, gene.split
                                     )
-                                    < 2
-                            ):
-                                raise Exception("Oligo does not have 2 cutsites")
-                            if gene.doublefrag == 0:
-                                gene.oligos.append(
-                                    SeqRecord(
-                                        combined_sequence,
-                                        id=sequence.id,
-                                        description="",
+                                len_cutsite = len(DIMPLE.cutsite) + len(DIMPLE.cutsite_buffer) + DIMPLE.cutsite_overhang
+                                # determine barcodes for subpool amplification based on smallest size
+                                if isinstance(dms_sequence_list, list):
+                                    frag_sizes = [len(xf) for xf in dms_sequence_list]
+                                    smallest_frag = dms_sequence_list[
+                                        frag_sizes.index(min(frag_sizes))
+                                    ].seq
+                                else:
+                                    smallest_frag = first_sequence.seq  # double mutants all have the size of the fragment
+                                while (
+                                        tmF < DIMPLE.primerTm[0] or tmR < DIMPLE.primerTm[0]
+                                ):  # swap out barcode if tm is low
+                                    difference = DIMPLE.synth_len - (
+                                            len(smallest_frag) + len_cutsite*2
+                                    )  # 14 bases is the length of the restriction sites with overhangs (7 bases each)
+                                    barF = DIMPLE.barcodeF.pop(0)
+                                    barR = DIMPLE.barcodeR.pop(0)
+                                    count += 1  # How many barcodes used
+                                    compileF.append(barF)
+                                    compileR.append(barR)
+                                    while difference / 2 > len(barF):
+                                        tmpF = DIMPLE.barcodeF.pop(0)
+                                        tmpR = DIMPLE.barcodeR.pop(0)
+                                        compileF.append(tmpF)
+                                        compileR.append(tmpR)
+                                        barF += tmpF
+                                        barR += tmpR
+                                        count += 1  # How many barcodes used
+                                    tmpfrag_1 = (
+                                            barF.seq[0: int(difference / 2)]
+                                            + DIMPLE.cutsite
+                                            + DIMPLE.cutsite_buffer
+                                            + tmpseq[0:DIMPLE.cutsite_overhang]
+                                    )  # include recognition site and the 4 base overhang
+                                    tmpfrag_2 = (
+                                            tmpseq[-DIMPLE.cutsite_overhang:]
+                                            + DIMPLE.cutsite_buffer.reverse_complement()
+                                            + DIMPLE.cutsite.reverse_complement()
+                                            + barR.seq.reverse_complement()[
+                                              0: difference - int(difference / 2)
+                                              ]
                                     )
-                                )
-                            else:
-                                grouped_oligos.append(
-                                    SeqRecord(
-                                        combined_sequence,
-                                        id=sequence.id,
-                                        description="",
+                                    # primers for amplifying subpools
+                                    offset = (
+                                            int(difference / 2) + len_cutsite
+                                    )  # add 11 bases for type 2 restriction
+                                    primerF, tmF = find_fragment_primer(tmpfrag_1, 25)
+                                    if len(primerF) > 21:
+                                        tmF = 0
+                                    primerR, tmR = find_fragment_primer(
+                                        tmpfrag_2.reverse_complement(), 25
                                     )
-                                )
+                                    if len(primerR) > 21:
+                                        tmR = 0
+                                group_oligos = []
+                                for (
+                                        sequence
+                                ) in (
+                                        dms_sequence_list
+                                ):  # add barcodes to the fragments to make the oligos
+                                    if insert or delete or duplicate:
+                                        difference = (
+                                                DIMPLE.synth_len - len(sequence.seq[DIMPLE.cutsite_overhang:-DIMPLE.cutsite_overhang]) - len_cutsite*2
+                                        )  # how many bases need to be added to make oligo correct length
+                                        offset = int(difference / 2)  # force it to be a integer
+                                        combined_sequence = (
+                                                tmpfrag_1[:offset]
+                                                + tmpfrag_1[-len_cutsite:]
+                                                + sequence.seq[DIMPLE.cutsite_overhang:-DIMPLE.cutsite_overhang]
+                                                + tmpfrag_2[:len_cutsite]
+                                                + tmpfrag_2[-(difference - offset):]
+                                        )
+                                    else:
+                                        combined_sequence = (
+                                                tmpfrag_1 + sequence.seq[DIMPLE.cutsite_overhang:-DIMPLE.cutsite_overhang] + tmpfrag_2
+                                        )
+                                    if (
+                                            primerF not in combined_sequence
+                                            or primerR.reverse_complement() not in combined_sequence
+                                    ):
+                                        print(primerF)
+                                        print(combined_sequence)
+                                        print("---")
+                                        print(combined_sequence.reverse_complement())
+                                        print(primerR)
+                                        raise Exception("primers no longer bind to oligo")
+                                    if (
+                                            combined_sequence.upper().count(DIMPLE.cutsite)
+                                            + combined_sequence.upper().count(
+                                            DIMPLE.cutsite.reverse_complement()
+                                            )
+                                            < 2
+                                    ):
+                                        raise Exception("Oligo does not have 2 cutsites")
+                                    if gene.doublefrag == 0:
+                                        gene.oligos.append(
+                                            SeqRecord(
+                                                combined_sequence,
+                                                id=sequence.id,
+                                                description="",
+                                            )
+                                        )
+                                    else:
+                                        grouped_oligos.append(
+                                            SeqRecord(
+                                                combined_sequence,
+                                                id=sequence.id,
+                                                description="",
+                                            )
+                                        )
 
-                        # Store primers for gene fragment
-                        if idx_type == 0:
-                            gene.barPrimer.append(
-                                SeqRecord(
-                                    primerF,
-                                    id=gene.geneid + "_oligoP_DMS-" + str(idx + 1) + "_F",
-                                    description="Frag"
-                                                + fragstart
-                                                + "-"
-                                                + fragend
-                                                + "_"
-                                                + str(tmF)
-                                                + "C",
-                                )
+                                # Store primers for gene fragment
+                                if idx_type == 0:
+                                    gene.barPrimer.append(
+                                        SeqRecord(
+                                            primerF,
+                                            id=gene.geneid + "_oligoP_DMS-" + str(idx + 1) + "_F",
+                                            description="Frag"
+                                                        + fragstart
+                                                        + "-"
+                                                        + fragend
+                                                        + "_"
+                                                        + str(tmF)
+                                                        + "C",
+                                        )
+                                    )
+                                    gene.barPrimer.append(
+                                        SeqRecord(
+                                            primerR,
+                                            id=gene.geneid + "_oligoP_DMS-" + str(idx + 1) + "_R",
+                                            description="Frag"
+                                                        + fragstart
+                                                        + "-"
+                                                        + fragend
+                                                        + "_"
+                                                        + str(tmR)
+                                                        + "C",
+                                        )
+                                    )
+                                else:
+                                    gene.barPrimer.append(
+                                        SeqRecord(
+                                            primerF,
+                                            id=gene.geneid + "_oligoP_DMS-double-" + str(idx + 1) + "_F",
+                                            description="Frag"
+                                                        + fragstart
+                                                        + "-"
+                                                        + fragend
+                                                        + "_"
+                                                        + str(tmF)
+                                                        + "C",
+                                        )
+                                    )
+                                    gene.barPrimer.append(
+                                        SeqRecord(
+                                            primerR,
+                                            id=gene.geneid + "_oligoP_DMS-double-" + str(idx + 1) + "_R",
+                                            description="Frag"
+                                                        + fragstart
+                                                        + "-"
+                                                        + fragend
+                                                        + "_"
+                                                        + str(tmR)
+                                                        + "C",
+                                        )
+                                    )
+                                print("Barcodes tested:" + str(count))
+                                # return unused barcodes
+                                DIMPLE.barcodeF.extend(compileF[:-2])
+                                DIMPLE.barcodeR.extend(compileR[:-2])
+                                print("Barcodes Remaining:" + str(len(DIMPLE.barcodeF)))
+                                compileF = []  # reset unused primers
+                                compileR = []
+                    if gene.doublefrag == 1:
+                        all_grouped_oligos.append(grouped_oligos)
+                # Resolve Double Fragment
+                if gene.doublefrag == 1:
+                    while len(all_grouped_oligos) > 1:
+                        listOne = all_grouped_oligos.pop(0)
+                        listTwo = all_grouped_oligos.pop(0)
+                        while listOne and listTwo:
+                            one = listOne.pop(0)
+                            two = listTwo.pop(0)
+                            combined_sequence = one.seq + two.seq.reverse_complement()
+                            combined_id = one.id + two.id
+                            gene.oligos.append(
+                                SeqRecord(combined_sequence, id=combined_id, description="")
                             )
-                            gene.barPrimer.append(
-                                SeqRecord(
-                                    primerR,
-                                    id=gene.geneid + "_oligoP_DMS-" + str(idx + 1) + "_R",
-                                    description="Frag"
-                                                + fragstart
-                                                + "-"
-                                                + fragend
-                                                + "_"
-                                                + str(tmR)
-                                                + "C",
-                                )
+                        if listOne or listTwo:
+                            if listOne:
+                                sequence = listOne.pop(0)
+                            if listTwo:
+                                sequence = listTwo.pop(0)
+                            combined_id = sequence.id
+                            combined_sequence = sequence.seq
+                            difference = 230 - len(combined_sequence)
+                            # print(len(tmpseq))
+                            barF2 = DIMPLE.barcodeF.pop(0)
+                            barR2 = DIMPLE.barcodeR.pop(0)
+                            while difference / 2 > len(barF2):
+                                barF2 += DIMPLE.barcodeF.pop(0)
+                                barR2 += DIMPLE.barcodeR.pop(0)
+                            combined_sequence2 = (
+                                barF2.seq[0 : int(difference / 2)]
+                                + combined_sequence
+                                + barR2.seq.reverse_complement()[
+                                    0 : difference - int(difference / 2)
+                                ]
                             )
-                        else:
-                            gene.barPrimer.append(
-                                SeqRecord(
-                                    primerF,
-                                    id=gene.geneid + "_oligoP_DMS-double-" + str(idx + 1) + "_F",
-                                    description="Frag"
-                                                + fragstart
-                                                + "-"
-                                                + fragend
-                                                + "_"
-                                                + str(tmF)
-                                                + "C",
-                                )
+                            gene.oligos.append(
+                                SeqRecord(combined_sequence2, id=combined_id, description="")
                             )
-                            gene.barPrimer.append(
-                                SeqRecord(
-                                    primerR,
-                                    id=gene.geneid + "_oligoP_DMS-double-" + str(idx + 1) + "_R",
-                                    description="Frag"
-                                                + fragstart
-                                                + "-"
-                                                + fragend
-                                                + "_"
-                                                + str(tmR)
-                                                + "C",
-                                )
+                    if all_grouped_oligos:
+                        one = all_grouped_oligos
+                        while one:
+                            sequence_one = one.pop(0)
+                            combined_id = sequence_one.id
+                            combined_sequence = sequence_one.seq
+                            difference = 230 - len(combined_sequence)
+                            # print(len(tmpseq))
+                            barF2 = DIMPLE.barcodeF.pop(0)
+                            barR2 = DIMPLE.barcodeR.pop(0)
+                            while difference / 2 > len(barF2):
+                                barF2 += DIMPLE.barcodeF.pop(0)
+                                barR2 += DIMPLE.barcodeR.pop(0)
+                            combined_sequence2 = (
+                                barF2.seq[0 : int(difference / 2)]
+                                + combined_sequence
+                                + barR2.seq.reverse_complement()[
+                                    0 : difference - int(difference / 2)
+                                ]
                             )
-                        print("Barcodes tested:" + str(count))
-                        # return unused barcodes
-                        DIMPLE.barcodeF.extend(compileF[:-2])
-                        DIMPLE.barcodeR.extend(compileR[:-2])
-                        print("Barcodes Remaining:" + str(len(DIMPLE.barcodeF)))
-                        compileF = []  # reset unused primers
-                        compileR = []
-            if gene.doublefrag == 1:
-                all_grouped_oligos.append(grouped_oligos)
-            idx += 1
-        # Resolve Double Fragment
-        if gene.doublefrag == 1:
-            while len(all_grouped_oligos) > 1:
-                listOne = all_grouped_oligos.pop(0)
-                listTwo = all_grouped_oligos.pop(0)
-                while listOne and listTwo:
-                    one = listOne.pop(0)
-                    two = listTwo.pop(0)
-                    combined_sequence = one.seq + two.seq.reverse_complement()
-                    combined_id = one.id + two.id
-                    gene.oligos.append(
-                        SeqRecord(combined_sequence, id=combined_id, description="")
-                    )
-                if listOne or listTwo:
-                    if listOne:
-                        sequence = listOne.pop(0)
-                    if listTwo:
-                        sequence = listTwo.pop(0)
-                    combined_id = sequence.id
-                    combined_sequence = sequence.seq
-                    difference = 230 - len(combined_sequence)
-                    # print(len(tmpseq))
-                    barF2 = DIMPLE.barcodeF.pop(0)
-                    barR2 = DIMPLE.barcodeR.pop(0)
-                    while difference / 2 > len(barF2):
-                        barF2 += DIMPLE.barcodeF.pop(0)
-                        barR2 += DIMPLE.barcodeR.pop(0)
-                    combined_sequence2 = (
-                        barF2.seq[0 : int(difference / 2)]
-                        + combined_sequence
-                        + barR2.seq.reverse_complement()[
-                            0 : difference - int(difference / 2)
-                        ]
-                    )
-                    gene.oligos.append(
-                        SeqRecord(combined_sequence2, id=combined_id, description="")
-                    )
-            if all_grouped_oligos:
-                one = all_grouped_oligos
-                while one:
-                    sequence_one = one.pop(0)
-                    combined_id = sequence_one.id
-                    combined_sequence = sequence_one.seq
-                    difference = 230 - len(combined_sequence)
-                    # print(len(tmpseq))
-                    barF2 = DIMPLE.barcodeF.pop(0)
-                    barR2 = DIMPLE.barcodeR.pop(0)
-                    while difference / 2 > len(barF2):
-                        barF2 += DIMPLE.barcodeF.pop(0)
-                        barR2 += DIMPLE.barcodeR.pop(0)
-                    combined_sequence2 = (
-                        barF2.seq[0 : int(difference / 2)]
-                        + combined_sequence
-                        + barR2.seq.reverse_complement()[
-                            0 : difference - int(difference / 2)
-                        ]
-                    )
-                    gene.oligos.append(
-                        SeqRecord(combined_sequence2, id=combined_id, description="")
-                    )
-        # Fragments
-        SeqIO.write(
-            gene.oligos,
-            os.path.join(folder.replace("\\", ""), gene.geneid + "_DMS_Oligos.fasta"),
-            "fasta",
-        )
-        # Barcode Primers
-        SeqIO.write(
-            gene.barPrimer,
-            os.path.join(
-                folder.replace("\\", ""), gene.geneid + "_DMS_Oligo_Primers.fasta"
-            ),
-            "fasta",
-        )
-        # Amplification Primers
-        SeqIO.write(
-            gene.genePrimer,
-            os.path.join(
-                folder.replace("\\", ""), gene.geneid + "_DMS_Gene_Primers.fasta"
-            ),
-            "fasta",
-        )
-        # Redundant Sequences
-        SeqIO.write(
-            gene.redundantSeq,
-            os.path.join(folder.replace("\\", ""), gene.geneid + "_Redundant.fasta"),
-            "fasta",
-        )
-        # Record finished gene for aligned genes
-        finishedGenes.extend([ii])
+                            gene.oligos.append(
+                                SeqRecord(combined_sequence2, id=combined_id, description="")
+                            )
+            # Fragments
+            if DIMPLE.stream_oligos:
+                gene.oligos.close()
+            else:
+                SeqIO.write(
+                    gene.oligos,
+                    os.path.join(folder.replace("\\", ""), gene.geneid + "_DMS_Oligos.fasta"),
+                    "fasta",
+                )
+            # Barcode Primers
+            SeqIO.write(
+                gene.barPrimer,
+                os.path.join(
+                    folder.replace("\\", ""), gene.geneid + "_DMS_Oligo_Primers.fasta"
+                ),
+                "fasta",
+            )
+            # Amplification Primers
+            SeqIO.write(
+                gene.genePrimer,
+                os.path.join(
+                    folder.replace("\\", ""), gene.geneid + "_DMS_Gene_Primers.fasta"
+                ),
+                "fasta",
+            )
+            # Redundant Sequences
+            if DIMPLE.redundant_table:
+                with open(
+                    os.path.join(folder.replace("\\", ""), gene.geneid + "_Redundant.tsv"), "w"
+                ) as handle:
+                    handle.write("variant\tduplicate_of\treason\n")
+                    for row in gene.redundantTable:
+                        handle.write("\t".join(row) + "\n")
+            if DIMPLE.redundant_sequences or not DIMPLE.redundant_table:
+                SeqIO.write(
+                    (variant.record() for variant in gene.redundantSeq),
+                    os.path.join(folder.replace("\\", ""), gene.geneid + "_Redundant.fasta"),
+                    "fasta",
+                )
 
 
 def combine_fragments(tandem, num_frag_per_oligo, split):
@@ -2050,146 +2579,539 @@ def combine_fragments(tandem, num_frag_per_oligo, split):
 
 
 def print_all(OLS, folder=""):
-    """Writes oligos and primers to files."""
+    """Writes oligos and primers to files.
+
+    With DIMPLE.stream_oligos, All_Oligos.fasta was already written by
+    generate_DMS_fragments and only the primers are written.
+    """
     if not isinstance(OLS[0], DIMPLE):
         raise TypeError("Not an instance of the DIMPLE class")
     alloligos = []
     allprimers = []
     for obj in OLS:
         try:
-            alloligos.extend(obj.oligos)
+            if not DIMPLE.stream_oligos:
+                alloligos.extend(obj.oligos)
             allprimers.extend(obj.barPrimer)
             allprimers.extend(obj.genePrimer)
         except AttributeError:
             print(obj.geneid + " has not been processed")
     # Remove redundant sequences?
-    SeqIO.write(
-        alloligos, os.path.join(folder.replace("\\", ""), "All_Oligos.fasta"), "fasta"
-    )
+    if not DIMPLE.stream_oligos:
+        SeqIO.write(
+            alloligos, os.path.join(folder.replace("\\", ""), "All_Oligos.fasta"), "fasta"
+        )
     SeqIO.write(
         allprimers, os.path.join(folder.replace("\\", ""), "All_Primers.fasta"), "fasta"
     )
 
-def post_qc(OLS):
+def encode_sequence(seq):
+    """Convert a sequence to a uint8 array of upper case character codes."""
+    return np.frombuffer(str(seq).upper().encode("ascii"), dtype=np.uint8)
+
+
+def popcount(words):
+    """Number of set bits in every element of a uint64 array."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).astype(np.int64)
+    counts = np.unpackbits(words.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+    return counts.reshape(words.shape)
+
+
+def filter_binding_words(words, length, strict=False):
+    """Bit-parallel version of filter_binding_sites for packed match words.
+
+    Bit j of a word is set if base j of the primer matches (see match_words), so
+    primers are at most 64 bases long. Seeds for every start position are found with shifts of the word, the first
+    seed is the lowest set bit and the matched bases are counted with popcount.
+    """
+    words = np.asarray(words, dtype=np.uint64)
+    first = np.full(len(words), 10, dtype=np.int64)
+    if length > 3:
+        one = np.uint64(1)
+        seed = words & (words >> one) & (words >> np.uint64(3))
+        relaxed = words & (words >> one) & (words >> np.uint64(2))
+        seed |= np.where(np.reshape(strict, (-1,)), np.uint64(0), relaxed)
+        seed &= np.uint64((1 << (length - 3)) - 1)  # seeds start before the last 3 bases
+        seeded = seed != 0
+        lowest = seed[seeded] & (~seed[seeded] + one)
+        first[seeded] = popcount(lowest - one)
+    first = np.minimum(first, length)
+    matched = popcount(words >> first.astype(np.uint64))
+    threeprime = (words >> np.uint64(length - 1)) & np.uint64(1) != 0
+    passing = (matched > (length - first) * 0.8) & (matched > 6) & threeprime
+    return passing, first
+
+
+def filter_binding_sites(match, strict=False):
+    """Apply the primer binding rules to a match mask with one row per offset.
+
+    A binding region starts at the first position k where bases k, k+1 and k+3
+    match (or k, k+1 and k+2 unless strict), otherwise at base 10. An offset
+    passes if more than 80% and more than 6 bases of that region match and the
+    3' base matches. strict may also be given per row.
+    Returns a mask of the passing rows and the start of every binding region.
+    """
+    windows, length = match.shape
+    first = np.full(windows, 10, dtype=np.int64)
+    if length > 3:
+        seed = match[:, :-3] & match[:, 1:-2] & match[:, 3:]
+        seed |= (
+            match[:, :-3]
+            & match[:, 1:-2]
+            & match[:, 2:-1]
+            & ~np.reshape(strict, (-1, 1))
+        )
+        seeded = seed.any(axis=1)
+        first[seeded] = seed[seeded].argmax(axis=1)
+    first = np.minimum(first, length)
+    counts = np.zeros((windows, length + 1), dtype=np.int64)
+    np.cumsum(match, axis=1, out=counts[:, 1:])
+    matched = counts[:, length] - counts[np.arange(windows), first]
+    passing = (matched > (length - first) * 0.8) & (matched > 6) & match[:, -1]
+    return passing, first
+
+
+def match_words(primer, fragment, offsets=None):
+    """Packed match words of a primer at the given offsets of a fragment.
+
+    The words are built in one pass over the primer, setting bit j for every
+    offset at once (Shift-And style), without a match mask per offset. Without
+    offsets every offset but the last is used.
+    """
+    if offsets is None:
+        windows = len(fragment) - len(primer)
+        words = np.zeros(windows, dtype=np.uint64)
+        for j, base in enumerate(primer):
+            words |= (fragment[j : j + windows] == base).astype(np.uint64) << np.uint64(j)
+        return words
+    words = np.zeros(len(offsets), dtype=np.uint64)
+    for j, base in enumerate(primer):
+        words |= (fragment[offsets + j] == base).astype(np.uint64) << np.uint64(j)
+    return words
+
+
+def find_binding_sites(primer, fragment, strict=False):
+    """Vectorized scan for every offset where a primer may anneal to a fragment.
+
+    primer and fragment are arrays from encode_sequence. Primers up to 64 bases
+    are compared to all offsets bit-parallel (match_words, filter_binding_words),
+    longer ones with sliding windows of the fragment and filter_binding_sites.
+    Returns arrays with the passing offsets and the start of their binding region.
+    """
+    length = len(primer)
+    windows = len(fragment) - length  # the last offset is never scanned
+    if windows <= 0 or length == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if length <= 64:
+        words = match_words(primer, fragment)
+        passing, first = filter_binding_words(words, length, strict)
+    else:
+        match = sliding_window_view(fragment, length)[:windows] == primer
+        passing, first = filter_binding_sites(match, strict)
+    return np.flatnonzero(passing), first[passing]
+
+
+class SeedIndex:
+    """k-mer index over both strands of a set of sequences.
+
+    The strands are joined into one array of character codes (sequence i has its
+    forward strand at 2*i and its reverse complement at 2*i+1) and every k-mer is
+    mapped to the positions where it occurs. A primer is then only compared at
+    offsets where one of its own k-mers (or only its 3' terminal k-mer, see
+    anchors) lands, for all sequences at once.
+    """
+
+    def __init__(self, sequences, k):
+        self.k = k
+        strands = []
+        for seq in sequences:
+            strands.extend([seq, seq.reverse_complement()])
+        self.lengths = np.array([len(x) for x in strands], dtype=np.int64)
+        self.starts = np.concatenate(([0], np.cumsum(self.lengths + 1)[:-1]))
+        self.text = encode_sequence("".join(str(x) + "-" for x in strands))
+        codes, positions = self.kmers(self.text)
+        order = np.argsort(codes, kind="stable")
+        self.codes = codes[order]
+        self.positions = positions[order]
+
+    def kmers(self, seq):
+        """Return the 2 bit packed code and position of every k-mer made of ACGT."""
+        bases = np.full(256, 4, dtype=np.int64)
+        bases[np.frombuffer(b"ACGT", dtype=np.uint8)] = np.arange(4)
+        bases = bases[seq]
+        if len(bases) < self.k:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        windows = sliding_window_view(bases, self.k)
+        valid = (windows < 4).all(axis=1)
+        codes = windows[valid] @ (4 ** np.arange(self.k - 1, -1, -1))
+        return codes, np.flatnonzero(valid)
+
+    def anchors(self, primer):
+        """Return the codes and shifts of the 3' terminal k-mer of a primer.
+
+        Besides the k-mer itself, every variant with one mismatch before its 3'
+        base is returned, all with the shift of the terminal k-mer.
+        """
+        shift = max(len(primer) - self.k, 0)
+        codes, shifts = self.kmers(primer[shift:])
+        if len(codes) != 1:
+            return codes, shifts  # primer shorter than k or not made of ACGT
+        weights = 4 ** np.arange(self.k - 1, 0, -1)  # every base but the 3' one
+        digits = (codes[0] // weights) % 4
+        substitutions = np.arange(1, 4)[:, None]
+        variants = codes[0] + ((digits + substitutions) % 4 - digits) * weights
+        codes = np.concatenate((codes, variants.ravel()))
+        return codes, np.full(len(codes), shift)
+
+    def binding_sites(self, primer, strand=0, bounds=None, anchored=False):
+        """Find binding sites of a primer at the seeded offsets of every strand.
+
+        primer is an array from encode_sequence. Offsets on strands with the same
+        orientation as strand use the relaxed first position rule of
+        filter_binding_sites, the others use the strict rule. bounds optionally
+        limits the offsets scanned on each strand (2*i and 2*i+1 for sequence i)
+        to a range (low, high). With anchored, offsets are only seeded by the 3'
+        terminal k-mer of the primer (see anchors) instead of all of its k-mers.
+        Returns a dictionary of (sequence, strand) to arrays of offsets and starts
+        of the binding regions.
+        """
+        length = len(primer)
+        codes, shifts = self.anchors(primer) if anchored else self.kmers(primer)
+        low = np.searchsorted(self.codes, codes, side="left")
+        high = np.searchsorted(self.codes, codes, side="right")
+        hits = [
+            self.positions[lo:hi] - shift for lo, hi, shift in zip(low, high, shifts)
+        ]
+        if not hits:
+            return {}
+        offsets = np.unique(np.concatenate(hits))
+        strands = np.searchsorted(self.starts, offsets, side="right") - 1
+        local = offsets - self.starts[np.maximum(strands, 0)]
+        keep = (
+            (strands >= 0) & (local >= 0) & (local < self.lengths[strands] - length)
+        )  # the last offset of each strand is never scanned
+        if bounds is not None:
+            low, high = np.array(bounds, dtype=np.int64).T
+            target = np.maximum(strands, 0)
+            keep &= (local >= low[target]) & (local < high[target])
+        offsets, strands, local = offsets[keep], strands[keep], local[keep]
+        if length <= 64:
+            words = match_words(primer, self.text, offsets)
+            passing, first = filter_binding_words(words, length, strands % 2 != strand)
+        else:
+            match = self.text[offsets[:, None] + np.arange(length)] == primer
+            passing, first = filter_binding_sites(match, strands % 2 != strand)
+        sites = {}
+        for target, offset, start in zip(
+            strands[passing].tolist(), local[passing].tolist(), first[passing].tolist()
+        ):
+            sites.setdefault((target // 2, target % 2), []).append((offset, start))
+        return sites
+
+
+class IndexWindow:
+    """Part of the first sequence of a SeedIndex, searched like a SeedIndex of its own.
+
+    Covers length bases from start. binding_sites only scans offsets inside the
+    window on both strands, seeded by the 3' terminal k-mer of the primer (see
+    SeedIndex.anchors), and returns them relative to the window. A gene sequence
+    can so be searched in the index of its whole record.
+    """
+
+    def __init__(self, index, start, length):
+        self.index = index
+        self.start = start
+        self.length = length
+
+    def binding_sites(self, primer, strand=0):
+        """Find binding sites of a primer in the window, see SeedIndex.binding_sites."""
+        reverseStart = int(self.index.lengths[1]) - self.start - self.length
+        starts = [self.start, reverseStart]
+        span = self.length - len(primer)  # the last offset of the window is never scanned
+        bounds = [(x, x + span) for x in starts]
+        bounds += [(0, 0)] * (len(self.index.lengths) - 2)
+        sites = self.index.binding_sites(primer, strand, bounds, anchored=True)
+        return {
+            (0, target): [(offset - starts[target], first) for offset, first in sites[(0, target)]]
+            for target in range(2)
+            if (0, target) in sites
+        }
+
+
+def binding_tm(primer, fragment, sites):
+    """Return True if the primer melts above 35C at any of the (offset, first) sites.
+
+    Melting temperatures of all sites are computed together with batch_Tm_NN.
+    Values within rounding of the threshold are recomputed with Tm_NN.
+    """
+    if not sites:
+        return False
+    melts = batch_Tm_NN(
+        [primer[first:] for i, first in sites],
+        [fragment[i + first : i + len(primer)].complement() for i, first in sites],
+        nn_table=mt.DNA_NN2,
+        de_table=mt.DNA_DE1,
+        imm_table=mt.DNA_IMM1,
+    )
+    for (i, first), melt in zip(sites, melts):
+        if abs(melt - 35) < 1e-6:
+            melt = Tm_NN(
+                primer[first:],
+                c_seq=fragment[i + first : i + len(primer)].complement(),
+                nn_table=mt.DNA_NN2,
+                de_table=mt.DNA_DE1,
+                imm_table=mt.DNA_IMM1,
+            )
+        if melt > 35:
+            return True
+    return False
+
+
+def check_primer_pair(primers, qc_data, known=None):
+    """Check one barcode primer pair against every unique cassette.
+
+    qc_data holds the cassettes prepared by post_qc. known optionally holds the
+    cached scan results of each primer (one value per cassette, see QCCache).
+    Cassettes with a negative value are scanned.
+    Returns a list of [primer id, cassette id] for every nonspecific
+    amplification found and the scan results of both primers.
+    """
+    nonspecific = []
+    if known is None:
+        known = [np.full(len(qc_data["cassettes"]), -1, dtype=np.int8) for x in primers]
+    results = [np.array(x, dtype=np.int8) for x in known]
+    primerCodes = [encode_sequence(primer.seq) for primer in primers]
+    primerSites = {}
+    for idxCassette, fragname in enumerate(
+        qc_data["cassettes"]
+    ):  # iterate over every OLS oligo
+        if (
+            primers[0].id.split("_")[2] != qc_data["names"][idxCassette]
+        ):  # ignore designed annealing (same name)
+            non = [False, False]
+            for idxDirection, primer in enumerate(primers):
+                primername = primer.id
+                primer = primer.seq
+                if results[idxDirection][idxCassette] < 0:
+                    if qc_data["index"] is not None and idxDirection not in primerSites:
+                        primerSites[idxDirection] = qc_data["index"].binding_sites(
+                            primerCodes[idxDirection], idxDirection
+                        )
+                    found = 0
+                    # the forward scan of the second primer runs on the reverse complement
+                    # and its reverse scan on the original strand
+                    for idxStrand, strict in enumerate([False, True]):
+                        target = (idxDirection + idxStrand) % 2
+                        fragment = qc_data["strands"][idxCassette][target]
+                        if qc_data["index"] is not None:
+                            sites = primerSites[idxDirection].get((idxCassette, target), [])
+                        else:
+                            sites, firsts = find_binding_sites(
+                                primerCodes[idxDirection],
+                                qc_data["codes"][idxCassette][target],
+                                strict,
+                            )
+                            sites = zip(sites.tolist(), firsts.tolist())
+                        if binding_tm(primer, fragment, list(sites)):
+                            found |= 1 << idxStrand
+                    results[idxDirection][idxCassette] = found
+                non[0] = non[0] or bool(results[idxDirection][idxCassette] & 1)
+                non[1] = non[1] or bool(results[idxDirection][idxCassette] & 2)
+                if not non[0] and not non[1]:
+                    break
+                if non[0] and non[1]:
+                    nonspecific.append([primername, fragname])
+    return nonspecific, results
+
+
+qc_worker_data = None  # cassettes sent once to each post_qc worker process
+
+
+def init_qc_worker(qc_data):
+    global qc_worker_data
+    qc_worker_data = qc_data
+
+
+def check_primer_pair_worker(task):
+    return check_primer_pair(task[0], qc_worker_data, task[1])
+
+
+def sequence_hash(seq):
+    """Hash a sequence independently of case."""
+    return hashlib.sha1(str(seq).upper().encode("ascii")).hexdigest()
+
+
+class QCCache:
+    """On-disk store of post_qc scan results for every primer and cassette.
+
+    Rows are primers in one scan direction and columns are cassettes, both keyed
+    by the hash of their sequence. Each value records whether the primer binds
+    with Tm>35 on the first (1) and/or second (2) strand it is scanned on, or -1
+    if the pair has not been scanned. Results only depend on the sequences, so
+    they stay valid when genes or subpools are added to a design.
+    """
+
+    version = 1  # increase when the binding rules change
+
+    def __init__(self, path, seed=0):
+        self.path = path
+        self.seed = seed if seed > 3 else 0  # seeds up to 3 find every site
+        self.rows = {}
+        self.cols = {}
+        self.values = np.full((0, 0), -1, dtype=np.int8)
+        if os.path.exists(path):
+            with np.load(path) as cache:
+                if (
+                    int(cache["version"]) == self.version
+                    and int(cache["seed"]) == self.seed
+                ):
+                    self.rows = {x: i for i, x in enumerate(cache["rows"].tolist())}
+                    self.cols = {x: i for i, x in enumerate(cache["cols"].tolist())}
+                    self.values = cache["values"]
+                else:
+                    print("QC cache was made with different settings and will be replaced")
+
+    def index(self, rows, cols):
+        """Return the positions of the row and column keys, adding missing ones.
+
+        The table is grown once for all new keys, so register every key of a run
+        in one call and pass the positions to lookup and update.
+        """
+        for key in rows:
+            self.rows.setdefault(key, len(self.rows))
+        for key in cols:
+            self.cols.setdefault(key, len(self.cols))
+        if self.values.shape != (len(self.rows), len(self.cols)):
+            values = np.full((len(self.rows), len(self.cols)), -1, dtype=np.int8)
+            values[: self.values.shape[0], : self.values.shape[1]] = self.values
+            self.values = values
+        return (
+            np.array([self.rows[key] for key in rows], dtype=np.int64),
+            np.array([self.cols[key] for key in cols], dtype=np.int64),
+        )
+
+    def lookup(self, rows, cols):
+        """Values at the row and column positions returned by index."""
+        return self.values[np.ix_(rows, cols)]
+
+    def update(self, rows, cols, values):
+        self.values[np.ix_(rows, cols)] = values
+
+    def save(self):
+        with open(self.path, "wb") as file:
+            np.savez_compressed(
+                file,
+                version=self.version,
+                seed=self.seed,
+                rows=np.array(list(self.rows), dtype=str),
+                cols=np.array(list(self.cols), dtype=str),
+                values=self.values,
+            )
+
+
+def post_qc(OLS, jobs=1, cache=None):
+    """Check every barcode primer pair for nonspecific amplification of other oligos.
+
+    jobs sets the number of processes the primer pairs are split across. Values
+    below 1 use every available core. Results are reported in the serial order.
+    cache is an optional file path where results are kept between runs so only
+    new primers and cassettes are scanned (see QCCache).
+    """
     if not isinstance(OLS[0], DIMPLE):
         raise TypeError("Not an instance of the DIMPLE class")
     # Post QC
-    all_oligos = []
+    processed = []
     all_barPrimers = []
     for obj in OLS:
         try:
-            all_oligos.extend(obj.oligos)
+            processed.append(obj.oligos)
             all_barPrimers.extend(obj.barPrimer)
         except AttributeError:
             print(obj.geneid + " has not been processed")
 
+    def all_oligos():
+        # oligos are read one at a time, streamed oligos are never all in memory
+        return itertools.chain.from_iterable(processed)
+
     print("Running QC for barcode primer specificity")
-    cassetteSet = set(all_oligos[0].id[:-6])
-    uCassette = [SeqRecord(all_oligos[0].seq, id=all_oligos[0].id[:-6])]
-    for idx in range(len(all_oligos)):
-        if not all_oligos[idx].id[:-6] in cassetteSet:
-            uCassette.append(SeqRecord(all_oligos[idx].seq, id=all_oligos[idx].id[:-6]))
-        cassetteSet.add(all_oligos[idx].id[:-6])
+    oligos = all_oligos()
+    first = next(oligos)
+    cassetteSet = set(first.id[:-6])
+    uCassette = [SeqRecord(first.seq, id=first.id[:-6])]
+    for oligo in itertools.chain([first], oligos):
+        if not oligo.id[:-6] in cassetteSet:
+            uCassette.append(SeqRecord(oligo.seq, id=oligo.id[:-6]))
+        cassetteSet.add(oligo.id[:-6])
+    # store both strands of every cassette once for the vectorized scan
+    qc_data = {
+        "cassettes": [fragment.id for fragment in uCassette],
+        "names": [
+            oligo.id.split("_")[2]
+            for oligo in itertools.islice(all_oligos(), len(uCassette))
+        ],
+        "strands": [
+            (fragment.seq, fragment.seq.reverse_complement()) for fragment in uCassette
+        ],
+        "codes": None,
+        "index": None,
+    }
+    if DIMPLE.qc_seed:
+        # index all cassettes once so primers are only compared at k-mer seed hits
+        qc_data["index"] = SeedIndex(
+            [fragment.seq for fragment in uCassette], DIMPLE.qc_seed
+        )
+    else:
+        qc_data["codes"] = [
+            (encode_sequence(strands[0]), encode_sequence(strands[1]))
+            for strands in qc_data["strands"]
+        ]
     grouped = iter(all_barPrimers)
-    grouped = zip(grouped, grouped)  # create the combinatorial comparisons
-    nonspecific = []
+    grouped = list(zip(grouped, grouped))  # create the combinatorial comparisons
+    known = [None] * len(grouped)
+    if cache:
+        qc_cache = QCCache(cache, DIMPLE.qc_seed)
+        rows, cols = qc_cache.index(
+            [
+                sequence_hash(primer.seq) + "_" + str(idxDirection)
+                for primers in grouped
+                for idxDirection, primer in enumerate(primers)
+            ],
+            [sequence_hash(fragment.seq) for fragment in uCassette],
+        )
+        rows = rows.reshape(len(grouped), 2)  # forward and reverse primer of each pair
+        known = [qc_cache.lookup(x, cols) for x in rows]
+    if jobs < 1:
+        jobs = os.cpu_count()
     # iterate over every barcode primer pair and match to each oligo to check for nonspecific amplification
-    for idxPrime, primers in enumerate(
-        grouped
-    ):  # iterate over every barcode primer pair
+    if jobs > 1 and len(grouped) > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=min(jobs, len(grouped)),
+            initializer=init_qc_worker,
+            initargs=(qc_data,),
+        )
+        with executor:
+            results = list(
+                executor.map(
+                    check_primer_pair_worker,
+                    zip(grouped, known),
+                    chunksize=max(1, len(grouped) // (jobs * 4)),
+                )
+            )
+    else:
+        results = [
+            check_primer_pair(primers, qc_data, x) for primers, x in zip(grouped, known)
+        ]
+    if cache:
+        for x, (found, values) in zip(rows, results):
+            qc_cache.update(x, cols, values)
+        qc_cache.save()
+    nonspecific = []
+    for primers, (found, values) in zip(grouped, results):
         print("Checking primer set:" + primers[0].id[:-2])
-        for idxCassette, fragment in enumerate(
-            uCassette
-        ):  # iterate over every OLS oligo
-            if (
-                primers[0].id.split("_")[2] != all_oligos[idxCassette].id.split("_")[2]
-            ):  # ignore designed annealing (same name)
-                fragname = fragment.id
-                fragment = fragment.seq
-                non = [[False], [False]]
-                for idxDirection, primer in enumerate(primers):
-                    primername = primer.id
-                    primer = primer.seq
-                    for i in range(
-                        len(fragment) - len(primer)
-                    ):  # iterate over the length of the oligo for a binding site
-                        match = [
-                            primer[j].lower() == fragment[i + j].lower()
-                            for j in range(len(primer))
-                        ]
-                        first = 10
-                        for k in range(len(match) - 3):
-                            if (match[k] and match[k + 1] and match[k + 3]) or (
-                                match[k] and match[k + 1] and match[k + 2]
-                            ):
-                                first = k
-                                break
-                        if (
-                            sum(match[first:]) > len(primer[first:]) * 0.8
-                            and sum(match[first:]) > 6
-                            and match[-1]
-                        ):  # string compare - sum of matched nt is greater than 80%
-                            try:
-                                melt = mt.Tm_NN(
-                                    primer[first:],
-                                    c_seq=fragment[
-                                        i + first : i + len(primer)
-                                    ].complement(),
-                                    nn_table=mt.DNA_NN2,
-                                    de_table=mt.DNA_DE1,
-                                    imm_table=mt.DNA_IMM1,
-                                )
-                                # if melt>20:
-                                #     print('Found non-specific match:'+fragment[i:i+len(primer)])
-                                #     print('                 primer:'+primer+' Tm:'+str(round(melt,1)))
-                                if melt > 35:
-                                    non[0].append(True)
-                            except ValueError as valerr:
-                                # print(str(valerr)+". Please check position manually:"+str(i+1)+" forward")
-                                # print('Primer:'+primer)
-                                # print('Match: '+fragment[i:i+len(primer)])
-                                pass
-                    fragment = fragment.reverse_complement()
-                    for i in range(len(fragment) - len(primer)):
-                        match = [
-                            primer[j].lower() == fragment[i + j].lower()
-                            for j in range(len(primer))
-                        ]
-                        first = 10
-                        for k in range(0, len(match) - 3, 1):
-                            if match[k] and match[k + 1] and match[k + 3]:
-                                first = k
-                                break
-                        if (
-                            sum(match[first:]) > len(primer[first:]) * 0.8
-                            and sum(match[first:]) > 6
-                            and match[-1]
-                        ):  # string compare - sum of matched nt is greater than 80%
-                            try:
-                                melt = mt.Tm_NN(
-                                    primer[first:],
-                                    c_seq=fragment[
-                                        i + first : i + len(primer)
-                                    ].complement(),
-                                    nn_table=mt.DNA_NN2,
-                                    de_table=mt.DNA_DE1,
-                                    imm_table=mt.DNA_IMM1,
-                                )
-                                # if melt > 20:
-                                #     print('Found non-specific match:'+fragment[i:i+len(primer)])
-                                #     print('                 primer:'+primer+' Tm:'+str(melt))
-                                if melt > 35:
-                                    non[1].append(True)
-                            except ValueError as valerr:
-                                # print(str(valerr)+". Please check position manually:"+str(i+1)+" reverse")
-                                # print('Primer:'+primer)
-                                # print('Match: '+fragment[i:i+len(primer)])
-                                pass
-                    if sum(non[0]) == 0 and sum(non[1]) == 0:
-                        break
-                    if sum(non[0]) > 0 and sum(non[1]) > 0:
-                        nonspecific.append([primername, fragname])
-                        print("Found Non-specific Amplification")
+        for pair in found:
+            nonspecific.append(pair)
+            print("Found Non-specific Amplification")
     if nonspecific:
         print("Nonspecific Primers: (Manually changing primer sequence recommended)")
         print(nonspecific)
@@ -1,4 +1,17 @@
+import itertools
+import math
+from functools import lru_cache
+
+import numpy as np
 from Bio import SeqIO, Align
+from Bio.SeqUtils import MeltingTemp as mt
+
+# Biopython melting temperature tables, keyed by name so they can be part of a cache key
+TM_TABLES = {
+    name: table for name, table in vars(mt).items() if name.isupper() and isinstance(table, dict)
+}
+TM_TABLE_NAMES = {id(table): name for name, table in TM_TABLES.items()}
+TM_CACHE_SIZE = 2 ** 16  # number of melting temperatures kept in the cache
 
 def find_mutations(oligo_file, wt_file, typeII_RE, typeII_RE_R, RE_gap=6):
     #typeII_RE = 'CGTCTC'  # I am using BsmbI
@@ -100,6 +113,54 @@ def codon_usage(usage):
     return usage_table
 
 
+class CodonModel:
+    """Codon usage model used to pick the codons of substitutions.
+
+    Built once from a usage table and the synonymous codons of each amino acid.
+    Holds the amino acid of every codon, the Hamming distances between all 64
+    codons and, for each (wild type codon, amino acid, minimum number of changed
+    bases), the candidate codons with their cumulative usage. Codons with a usage
+    of cutoff or less are only picked if every candidate is below the cutoff.
+    """
+
+    def __init__(self, usage, synonymous_codons, cutoff=0.1):
+        self.codons = ["".join(x) for x in itertools.product("ACGT", repeat=3)]
+        self.index = {codon: i for i, codon in enumerate(self.codons)}
+        self.synonymous_codons = {name: list(codons) for name, codons in synonymous_codons.items()}
+        self.aa = {}
+        for name, codons in self.synonymous_codons.items():
+            for codon in codons:
+                self.aa.setdefault(codon, name)  # first amino acid listing the codon
+        bases = np.array([list(codon) for codon in self.codons])
+        self.hamming = (bases[:, None, :] != bases[None, :, :]).sum(axis=2)
+        weights = np.array([usage.get(codon, 0) for codon in self.codons], dtype=float)
+        self.weights = np.where(weights > cutoff, weights, 0)
+        self.distributions = {}
+
+    def candidates(self, wt_codon, aa, min_change=1):
+        """Return the codons of aa with at least min_change bases different from wt_codon and their cumulative probabilities."""
+        key = (wt_codon, aa, min_change)
+        if key not in self.distributions:
+            wt = self.index[wt_codon]
+            codons = [
+                codon for codon in self.synonymous_codons[aa]
+                if self.hamming[wt, self.index[codon]] >= min_change
+            ]
+            p = self.weights[[self.index[codon] for codon in codons]]
+            if not p.sum():
+                p = np.ones(len(codons))
+            self.distributions[key] = (codons, np.cumsum(p) / p.sum())
+        return self.distributions[key]
+
+    def sample(self, keys, rng):
+        """Pick a codon for each (wt_codon, aa, min_change) key with a single draw from rng."""
+        picked = []
+        for key, draw in zip(keys, rng.random(len(keys))):
+            codons, cumulative = self.candidates(*key)
+            picked.append(codons[min(np.searchsorted(cumulative, draw, side="right"), len(codons) - 1)])
+        return picked
+
+
 def findORF(gene):
     # Scan through all strands and frames for open reading frames
     min_protein_len = 100  # Support for finding gene position in vector
@@ -172,4 +233,289 @@ def findORF(gene):
         except:
             print("Please enter a number")
             quest = "n"
-    return start, end
\ No newline at end of file
+    return start, end
+
+
+@lru_cache(maxsize=TM_CACHE_SIZE)
+def cached_Tm_NN(seq, c_seq, nn_table, de_table, imm_table):
+    return mt.Tm_NN(
+        seq,
+        c_seq=c_seq,
+        nn_table=TM_TABLES.get(nn_table),
+        de_table=TM_TABLES.get(de_table),
+        imm_table=TM_TABLES.get(imm_table),
+    )
+
+
+def Tm_NN(seq, c_seq=None, nn_table=None, de_table=None, imm_table=None):
+    """Memoized Bio.SeqUtils.MeltingTemp.Tm_NN.
+
+    Results are kept in a bounded LRU cache keyed on the sequences and the names of
+    the Biopython tables. Values are returned exactly as Biopython computes them.
+    Calls with tables that are not part of Biopython and calls that raise are not cached.
+    """
+    tables = [nn_table, de_table, imm_table]
+    names = [TM_TABLE_NAMES.get(id(table)) for table in tables]
+    if any(table is not None and name is None for table, name in zip(tables, names)):
+        return mt.Tm_NN(
+            seq, c_seq=c_seq, nn_table=nn_table, de_table=de_table, imm_table=imm_table
+        )
+    return cached_Tm_NN(str(seq), None if c_seq is None else str(c_seq), *names)
+
+
+def tm_cache_info():
+    """Return hits, misses, maximum and current size of the melting temperature cache."""
+    return cached_Tm_NN.cache_info()
+
+
+NN_SYMBOLS = "ACGTI."  # bases accepted by Tm_NN and the gap used for dangling ends
+NN_COMPLEMENT = str.maketrans("ACGTI", "TGCAI")
+nn_table_arrays = {}  # compiled tables for batch_Tm_NN
+
+
+def compile_nn_table(table, reverse=False):
+    """Compile a Biopython table into enthalpy, entropy and presence arrays.
+
+    Arrays are indexed by the symbol codes of a key "ab/cd" as ((a*6+b)*6+c)*6+d.
+    With reverse the reversed key is also looked up when the key itself is missing.
+    """
+    size = len(NN_SYMBOLS) ** 4
+    enthalpy = np.zeros(size)
+    entropy = np.zeros(size)
+    found = np.zeros(size, dtype=bool)
+    for code, (a, b, c, d) in enumerate(itertools.product(NN_SYMBOLS, repeat=4)):
+        key = a + b + "/" + c + d
+        for name in [key, key[::-1]] if reverse else [key]:
+            if name in table:
+                enthalpy[code], entropy[code] = table[name]
+                found[code] = True
+                break
+    return enthalpy, entropy, found
+
+
+def nn_clean(seq):
+    """Same clean up as Tm_NN: upper case DNA without characters missing from the tables."""
+    seq = str(seq).upper().replace("U", "T")
+    return "".join(b for b in seq if b in "ACGTI")
+
+
+def nn_arrays(nn_table, tmm_table, imm_table, de_table):
+    """Return the compiled tables for batch_Tm_NN, compiling them only once."""
+    key = (id(nn_table), id(tmm_table), id(imm_table), id(de_table))
+    if key not in nn_table_arrays:
+        imm = compile_nn_table(imm_table, reverse=True)
+        nn = compile_nn_table(nn_table, reverse=True)
+        # zipping looks in the mismatch table before the nearest neighbor table
+        neighbors = (
+            np.where(imm[2], imm[0], nn[0]),
+            np.where(imm[2], imm[1], nn[1]),
+            imm[2] | nn[2],
+        )
+        nn_table_arrays[key] = {
+            "tables": (nn_table, tmm_table, imm_table, de_table),  # keep ids valid
+            "neighbors": neighbors,
+            "tmm": compile_nn_table(tmm_table),
+            "de": compile_nn_table(de_table),
+        }
+    return nn_table_arrays[key]
+
+
+def batch_Tm_NN(
+    seqs,
+    c_seqs=None,
+    nn_table=None,
+    tmm_table=None,
+    imm_table=None,
+    de_table=None,
+    dnac1=25,
+    dnac2=25,
+    Na=50,
+):
+    """Nearest neighbor melting temperatures for many duplexes at once.
+
+    Follows Bio.SeqUtils.MeltingTemp.Tm_NN with its default shift, ion
+    concentrations and salt correction (method 5), including dangling ends when
+    a complement is longer than its sequence, terminal and internal mismatches.
+    The tables are compiled into lookup arrays once and every duplex is scored
+    with array operations. Results agree with Tm_NN to within float rounding.
+    Duplexes that Tm_NN rejects with a ValueError get NaN.
+    """
+    if nn_table is None:
+        nn_table = mt.DNA_NN3
+    if tmm_table is None:
+        tmm_table = mt.DNA_TMM1
+    if imm_table is None:
+        imm_table = mt.DNA_IMM1
+    if de_table is None:
+        de_table = mt.DNA_DE1
+    tables = nn_arrays(nn_table, tmm_table, imm_table, de_table)
+    seqs = [nn_clean(x) for x in seqs]
+    if c_seqs is None:
+        c_seqs = [None] * len(seqs)
+    c_seqs = [nn_clean(c) if c else x.translate(NN_COMPLEMENT) for x, c in zip(seqs, c_seqs)]
+    count = len(seqs)
+    if not count:
+        return np.empty(0)
+    length = np.array([len(x) for x in seqs], dtype=np.int64)
+    c_length = np.array([len(x) for x in c_seqs], dtype=np.int64)
+    width = max(length.max(), c_length.max()) + 1
+    codes = np.full(256, len(NN_SYMBOLS) - 1, dtype=np.int64)
+    codes[np.frombuffer(NN_SYMBOLS.encode(), dtype=np.uint8)] = np.arange(len(NN_SYMBOLS))
+    seq = codes[
+        np.frombuffer("".join(x.ljust(width, ".") for x in seqs).encode(), dtype=np.uint8)
+    ].reshape(count, width)
+    c_seq = codes[
+        np.frombuffer("".join(x.ljust(width, ".") for x in c_seqs).encode(), dtype=np.uint8)
+    ].reshape(count, width)
+    rows = np.arange(count)
+    enthalpy = np.zeros(count)
+    entropy = np.zeros(count)
+    valid = np.minimum(length, c_length) > 0  # Tm_NN needs a sequence for the salt correction
+
+    def key(a, b, c, d):
+        return ((a * 6 + b) * 6 + c) * 6 + d
+
+    # the duplex covers both sequences, trimmed to a single dangling base
+    low = np.zeros(count, dtype=np.int64)
+    high = np.minimum(np.maximum(length, c_length), np.minimum(length, c_length) + 1)
+    dangling = valid & (length != c_length)
+    end = np.maximum(high - 1, 1)
+    de = key(c_seq[rows, end], c_seq[rows, end - 1], seq[rows, end], seq[rows, end - 1])
+    valid &= ~dangling | tables["de"][2][de]
+    enthalpy += np.where(dangling, tables["de"][0][de], 0)
+    entropy += np.where(dangling, tables["de"][1][de], 0)
+    high -= dangling
+    # terminal mismatches
+    start = np.minimum(low + 1, width - 1)
+    tmm = key(c_seq[rows, start], c_seq[rows, low], seq[rows, start], seq[rows, low])
+    terminal = (high - low >= 2) & tables["tmm"][2][tmm]
+    enthalpy += np.where(terminal, tables["tmm"][0][tmm], 0)
+    entropy += np.where(terminal, tables["tmm"][1][tmm], 0)
+    low += terminal
+    end = np.maximum(high - 1, 1)
+    tmm = key(seq[rows, end - 1], seq[rows, end], c_seq[rows, end - 1], c_seq[rows, end])
+    terminal = (high - low >= 2) & tables["tmm"][2][tmm]
+    enthalpy += np.where(terminal, tables["tmm"][0][tmm], 0)
+    entropy += np.where(terminal, tables["tmm"][1][tmm], 0)
+    high -= terminal
+    # initiation
+    init = [nn_table["init"]] * count
+    for idx, x in enumerate(seqs):
+        if not x:
+            continue
+        terms = [nn_table["init"]]
+        if "G" in x or "C" in x:
+            terms.append(nn_table["init_oneG/C"])
+        else:
+            terms.append(nn_table["init_allA/T"])
+        if x.startswith("T"):
+            terms.append(nn_table["init_5T/A"])
+        if x.endswith("A"):
+            terms.append(nn_table["init_5T/A"])
+        ends = x[0] + x[-1]
+        terms.append([v * (ends.count("A") + ends.count("T")) for v in nn_table["init_A/T"]])
+        terms.append([v * (ends.count("G") + ends.count("C")) for v in nn_table["init_G/C"]])
+        init[idx] = np.sum(terms, axis=0)
+    init = np.array(init, dtype=float).reshape(count, 2)
+    enthalpy += init[:, 0]
+    entropy += init[:, 1]
+    # zipping
+    position = np.arange(width - 1)
+    inside = (position >= low[:, None]) & (position < high[:, None] - 1)
+    pairs = key(seq[:, :-1], seq[:, 1:], c_seq[:, :-1], c_seq[:, 1:])
+    valid &= (tables["neighbors"][2][pairs] | ~inside).all(axis=1)
+    enthalpy += np.where(inside, tables["neighbors"][0][pairs], 0).sum(axis=1)
+    entropy += np.where(inside, tables["neighbors"][1][pairs], 0).sum(axis=1)
+    # salt correction (method 5) and melting temperature
+    entropy += 0.368 * (length - 1) * math.log(Na * 1e-3)
+    k = (dnac1 - (dnac2 / 2.0)) * 1e-9
+    with np.errstate(divide="ignore", invalid="ignore"):
+        melting_temp = (1000 * enthalpy) / (entropy + (1.987 * math.log(k))) - 273.15
+    return np.where(valid, melting_temp, np.nan)
+
+
+class WindowTm:
+    """Nearest neighbor melting temperature of any window of a sequence.
+
+    Stacking enthalpies and entropies are additive, so after prefix sums over
+    the sequence the Tm of a window is found in constant time. Matches Tm_NN for
+    perfect duplexes with its default concentrations and salt correction
+    (method 5). Windows with characters other than ACGT are passed to Tm_NN.
+    """
+
+    def __init__(self, seq, nn_table=None):
+        if nn_table is None:
+            nn_table = mt.DNA_NN3
+        self.seq = str(seq).upper()
+        self.nn_table = nn_table
+        self.saltcorr = 0.368 * math.log(50 * 1e-3)  # per base stack at 50 mM Na
+        self.k = 1.987 * math.log((25 - (25 / 2.0)) * 1e-9)  # 25 nM of each strand
+        self.enthalpy = [0.0]  # sums over the stacks before each position
+        self.entropy = [0.0]
+        self.gc = [0]  # counts of G or C before each position
+        self.other = [0]  # counts of characters other than ACGT before each position
+        for base, after in itertools.zip_longest(self.seq, self.seq[1:], fillvalue=""):
+            stack = base + after + "/" + (base + after).translate(NN_COMPLEMENT)
+            value = nn_table.get(stack, nn_table.get(stack[::-1], (0.0, 0.0)))
+            self.enthalpy.append(self.enthalpy[-1] + value[0])
+            self.entropy.append(self.entropy[-1] + value[1])
+            self.gc.append(self.gc[-1] + (base in "GC"))
+            self.other.append(self.other[-1] + (base not in "ACGT"))
+
+    def tm(self, start, end):
+        """Melting temperature of seq[start:end]."""
+        end = min(end, len(self.seq))  # same as slicing
+        if end - start < 2 or self.other[end] != self.other[start]:
+            return Tm_NN(self.seq[start:end], nn_table=self.nn_table)
+        table = self.nn_table
+        delta_h, delta_s = table["init"]
+        if self.gc[end] == self.gc[start]:
+            delta_h += table["init_allA/T"][0]
+            delta_s += table["init_allA/T"][1]
+        else:
+            delta_h += table["init_oneG/C"][0]
+            delta_s += table["init_oneG/C"][1]
+        ends = self.seq[start] + self.seq[end - 1]
+        penalties = (ends[0] == "T") + (ends[1] == "A")
+        AT = ends.count("A") + ends.count("T")
+        GC = 2 - AT
+        delta_h += table["init_5T/A"][0] * penalties
+        delta_s += table["init_5T/A"][1] * penalties
+        delta_h += table["init_A/T"][0] * AT + table["init_G/C"][0] * GC
+        delta_s += table["init_A/T"][1] * AT + table["init_G/C"][1] * GC
+        delta_h += self.enthalpy[end - 1] - self.enthalpy[start]
+        delta_s += self.entropy[end - 1] - self.entropy[start]
+        delta_s += self.saltcorr * (end - start - 1)
+        return (1000 * delta_h) / (delta_s + self.k) - 273.15
+
+
+class EditHash:
+    """Digest of a sequence with one window replaced, without building it.
+
+    Polynomial hashes of every prefix of the sequence are kept, so the digest of
+    seq[:start] + inserted + seq[end:] only costs the inserted bases. The digest
+    depends on the edited sequence alone (not the sequence or edit it came from)
+    and includes its length, so equal sequences always give equal digests.
+    """
+
+    base = 131
+    modulus = (1 << 127) - 1  # Mersenne prime, 127 bit digests
+
+    def __init__(self, seq):
+        self.seq = str(seq)
+        self.prefix = [0]  # hashes of seq[:n]
+        self.power = [1]  # base ** n
+        for char in self.seq:
+            self.prefix.append((self.prefix[-1] * self.base + ord(char)) % self.modulus)
+            self.power.append(self.power[-1] * self.base % self.modulus)
+
+    def digest(self, start, end, inserted=""):
+        """Length and hash of seq[:start] + inserted + seq[end:]."""
+        inserted = str(inserted)
+        value = self.prefix[start]
+        for char in inserted:
+            value = (value * self.base + ord(char)) % self.modulus
+        tail = len(self.seq) - end
+        suffix = self.prefix[-1] - self.prefix[end] * self.power[tail]
+        value = (value * self.power[tail] + suffix) % self.modulus
+        return start + len(inserted) + tail, value